@@ -1,29 +1,73 @@
 #!/usr/bin/env python3
 
-import aria2p
+import base64
 import click
 import click_log
+import json
 import logging
+import os
 import re
-import yaml
+import shlex
 
+from datetime import timedelta
+from functools import partial
 from pathlib import Path
-from fnmatch import fnmatch
-from torrent_parser import TorrentFileParser, InvalidTorrentDataException
+from urllib.parse import quote
+from fnmatch import translate as fnmatch_translate
 from typing import Pattern
 
 from aria2rpc import (
     load_aria2_config,
     guess_path,
+    multicall,
     task_briefing,
     LOG_LEVELS,
+    STOPPED_STATUS,
+    TRANSPORTS,
+    WAITING_PAGE_SIZE,
     DEFAULT_CONFIG_PATH,
     DEFAULT_TORRENT_EXCLUDE_LIST_FILE,
 )
+from aria2rpc.control import ControlFile, ControlFileError, download_path
+from aria2rpc.index import TaskIndex
+from aria2rpc.lazy import lazy_import
+from aria2rpc.torrent import BencodeError, TorrentMetadata, magnet_info_hash
+
+
+# heavy, only imported by the subcommands using them
+aria2p = lazy_import("aria2p")
+yaml = lazy_import("yaml")
+requests = lazy_import("requests")
 
 
 PATTERN_SUPPORTED_URI = re.compile("(http(s)?|ftp(s)|sftp)://|magnet:")
 PATTERN_MAGNET_URI = re.compile("magnet:")
+BULK_BATCH_SIZE = 50
+INDEX_CACHE_MAX_AGE = 300
+# keys requested by `list`, the files of non-BitTorrent tasks are requested apart
+LIST_KEYS = [
+    "gid",
+    "status",
+    "totalLength",
+    "completedLength",
+    "downloadSpeed",
+    "uploadSpeed",
+    "dir",
+    "bittorrent",
+]
+LIST_COLUMNS = [
+    "gid",
+    "status",
+    "totalLength",
+    "completedLength",
+    "downloadSpeed",
+    "uploadSpeed",
+    "eta",
+    "name",
+]
+TASK_STATUS = ("active", "waiting", "paused", *STOPPED_STATUS)
+# keys requested by remove/pause/resume to select tasks, "bittorrent" for the name
+SELECT_KEYS = ["gid", "status", "dir", "bittorrent"]
 
 FEATURE_DEBUG = False
 
@@ -54,25 +98,28 @@ def is_aria2_file(filename):
     return ".aria2" == Path(filename).suffix
 
 
-def torrent_filter_file(torrent_info, excludes):
-    if "files" not in torrent_info:  # filter if there is multi-files torrent
-        file_length = torrent_info.get("info", {}).get("length", 0)
-        return False, file_length
+def torrent_filter_file(torrent, excludes, echo=click.echo):
+    """
+    :param torrent: aria2rpc.torrent.TorrentMetadata, file entries are consumed as a stream
+    :param excludes: ExcludeMatcher
+    :param echo: callable, output of the file list
+    :return: (selected file indexes, selected file size)
+    """
+    if not torrent.is_multi_file:  # filter if there is multi-files torrent
+        return False, torrent.length
     selected = []
     selected_file_size = 0
-    for idx, file_info in enumerate(torrent_info["files"], 1):
-        file_path_info = file_info["path"]
-        longest_path = str(max(file_path_info, key=len))
+    for idx, file_path_info, file_length in torrent.files():
+        longest_path = str(max(file_path_info, key=len, default=""))
         filename_max_len = len(longest_path.encode("utf8"))
         file_path = Path().joinpath(*file_path_info)
-        file_length = file_info["length"]
 
         # 跳过超长的文件名（linux <= 255)
         if filename_max_len > 255:
             symbol = click.style("⚠️", fg="red")
             file = click.style(file_path, fg="yellow")
             debug_info = f" {filename_max_len} >= 255" if FEATURE_DEBUG else ""
-            click.echo(f'{symbol} "{file}" ({file_length=}){debug_info}')
+            echo(f'{symbol} "{file}" ({file_length=}){debug_info}')
             continue
 
         _lower_file_path = str(file_path).lower()  # for fnmatch case-insensitive
@@ -82,7 +129,7 @@ def torrent_filter_file(torrent_info, excludes):
             # logging.info(f'* "{file_path}", {file_length=}')
             symbol = click.style("+", fg="green")
             file = click.style(file_path, fg="green")
-            click.echo(f'{symbol} "{file}" ({file_length=})')
+            echo(f'{symbol} "{file}" ({file_length=})')
             selected.append(str(idx))
             selected_file_size += file_length
         else:  # skip
@@ -90,35 +137,695 @@ def torrent_filter_file(torrent_info, excludes):
             symbol = click.style("-", fg="red")
             file = click.style(file_path, fg="bright_black")
             debug_info = f" <= {matched_pattern}" if FEATURE_DEBUG else ""
-            click.echo(f'{symbol} "{file}" ({file_length=}){debug_info}')
+            echo(f'{symbol} "{file}" ({file_length=}){debug_info}')
     return selected, selected_file_size
 
 
+class ExcludeMatcher:
+    """
+    All exclude patterns compiled into a few alternation regexes, one named group per pattern.
+    Every alternative is anchored at the start, so the first pattern in order wins,
+    as if the patterns were tested one by one.
+    """
+
+    # backreferences are numbered, they break once the regex is a part of the alternation
+    PATTERN_BACKREFERENCE = re.compile(r"\\[1-9]|\(\?P=")
+
+    def __init__(self, patterns):
+        self.patterns = patterns
+        self.chunks = []  # [(compiled regex, pattern index if searched alone)]
+        run = []
+        for idx, p in enumerate(patterns):
+            alternative = self._alternative(idx, p)
+            if alternative is None:
+                self._compile(run)
+                self.chunks.append((p, idx))
+                run = []
+            else:
+                run.append((idx, alternative))
+        self._compile(run)
+
+    def _alternative(self, idx, p):
+        """:return: str, or None if the regex must be searched alone"""
+        if not isinstance(p, Pattern):  # fnmatch
+            return f"(?P<p{idx}>{fnmatch_translate(p)})"
+        if self.PATTERN_BACKREFERENCE.search(p.pattern):
+            return None
+        alternative = f"(?P<p{idx}>(?s:.*?)(?i:{p.pattern}))"  # search, ignore case
+        try:
+            re.compile(alternative)
+        except re.error:  # e.g. inline global flags
+            return None
+        return alternative
+
+    def _compile(self, run):
+        if not run:
+            return
+        try:
+            self.chunks.append((re.compile("|".join(alt for _, alt in run)), None))
+        except re.error:  # e.g. duplicate group names, fall back to one by one
+            for item in run:
+                self.chunks.append((re.compile(item[1]), None))
+
+    def match(self, filename):
+        filename = str(filename)
+        for regex, idx in self.chunks:
+            if idx is None:
+                matched = regex.match(filename)
+                if matched:
+                    idx = int(matched.lastgroup[1:])
+            else:
+                matched = regex.search(filename)
+            if matched:
+                p = self.patterns[idx]
+                return matched, p.pattern if isinstance(p, Pattern) else p
+        return False, None
+
+
 def build_exclude_list(filename):
     exclude_patterns = []
     if not filename:
-        return exclude_patterns
+        return ExcludeMatcher(exclude_patterns)
     with open(filename, encoding="utf8") as f:
         config = yaml.safe_load(f)
     for line in config["remove"].splitlines():
         exclude_patterns.append(
             re.compile(line[1:], flags=re.IGNORECASE) if line.startswith("/") else line
         )
-    return exclude_patterns
+    return ExcludeMatcher(exclude_patterns)
 
 
 def match_remove_pattern(filename, exclude_patterns):
-    for p in exclude_patterns:
-        if isinstance(p, Pattern):
-            matched = p.search(str(filename))
-            pat = p.pattern
+    """
+    :param filename: str
+    :param exclude_patterns: ExcludeMatcher
+    :return: (matched, pattern)
+    """
+    return exclude_patterns.match(filename)
+
+
+def task_options(download_dir=None, set_pause=False, allow_overwrite=False):
+    options = {
+        "continue": "true",
+    }
+    if download_dir:
+        options["dir"] = str(Path(download_dir))
+    if set_pause:
+        options["pause"] = str(set_pause).lower()
+    if allow_overwrite:
+        options["allow-overwrite"] = str(allow_overwrite).lower()
+    return options
+
+
+def prepare_torrent(filename, excludes):
+    """
+    Parse and filter a torrent file, run in the worker processes of `add --bulk`
+    :param filename: str
+    :param excludes: ExcludeMatcher
+    :return: dict, "torrent" is the base64 payload of addTorrent, "error" is set on failure
+    """
+    output = []
+    try:
+        with open(filename, "rb") as f:
+            data = f.read()
+        torrent = TorrentMetadata(data)
+        selected_file_idx, selected_file_size = torrent_filter_file(
+            torrent, excludes, echo=output.append
+        )
+        torrent_hash = torrent.info_hash
+    except (OSError, BencodeError) as e:
+        return {"uri": filename, "output": output, "error": str(e)}
+    return {
+        "uri": filename,
+        "output": output,
+        "torrent": base64.b64encode(data).decode("ascii"),
+        "select_file": ",".join(selected_file_idx) if selected_file_idx else None,
+        "size": selected_file_size,
+        "info_hash": torrent_hash,
+        "error": None,
+    }
+
+
+def prepare_control_file(filename, excludes):
+    """
+    Recover a task from an aria2 control file, without contacting aria2.
+    The torrent is looked up next to the download as "<info hash>.torrent" (--bt-save-metadata)
+    or "<name>.torrent", else the task is recovered from a magnet URI.
+    :param filename: str, "<download>.aria2"
+    :param excludes: ExcludeMatcher
+    :return: dict, "torrent" is the base64 payload of addTorrent or None, "error" is set on failure
+    """
+    output = []
+    try:
+        control = ControlFile.load(filename)
+    except (OSError, ControlFileError) as e:
+        return {"uri": filename, "output": output, "error": str(e)}
+    if not control.info_hash:
+        return {
+            "uri": filename,
+            "output": output,
+            "error": "not a BitTorrent download, the URI is not saved in the control file",
+        }
+    path = download_path(filename)
+    output.append(
+        f"{control.progress:7.1%} {path.name}"
+        f" ({convert_bytes(control.completed_length)} / {convert_bytes(control.total_length)})"
+    )
+
+    data = torrent = None
+    for candidate in (
+        path.with_name(f"{control.info_hash}.torrent"),
+        path.with_name(f"{path.name}.torrent"),
+    ):
+        try:
+            data = candidate.read_bytes()
+            torrent = TorrentMetadata(data)
+        except (OSError, BencodeError):
+            continue
+        if torrent.info_hash == control.info_hash:
+            break
+        torrent = None
+    selected_file_idx = None
+    if torrent is not None and torrent.is_multi_file:
+        selected_file_idx, _ = torrent_filter_file(
+            torrent, excludes, echo=lambda message: None
+        )
+        files = list(torrent.files())
+        completed = control.file_progress([file.length for file in files])
+        for file, completed_length in zip(files, completed):
+            symbol = "+" if str(file.index) in selected_file_idx else "-"
+            progress = completed_length / file.length if file.length else 1.0
+            output.append(
+                f'{symbol} {progress:7.1%} "{Path(*file.path)}" (file_length={file.length})'
+            )
+    return {
+        "uri": filename,
+        "output": output,
+        "info_hash": control.info_hash,
+        "dir": str(path.parent),
+        "torrent": base64.b64encode(data).decode("ascii") if torrent else None,
+        "magnet": f"magnet:?xt=urn:btih:{control.info_hash}&dn={quote(path.name)}",
+        "select_file": ",".join(selected_file_idx) if selected_file_idx else None,
+        "error": None,
+    }
+
+
+def recovery_call(client, recovered, options):
+    """
+    :param recovered: dict, see `prepare_control_file`
+    :return: (method, params), add the task in the directory of the control file
+    """
+    task_opts = dict(options)
+    task_opts["dir"] = recovered["dir"]
+    if recovered["select_file"]:
+        task_opts["select-file"] = recovered["select_file"]
+    if recovered["torrent"]:
+        return client.ADD_TORRENT, [recovered["torrent"], [], task_opts]
+    return client.ADD_URI, [[recovered["magnet"]], task_opts]
+
+
+def queue_pages(method, offset=0, limit=None, keys=LIST_KEYS):
+    """
+    :param method: str, aria2.tellWaiting or aria2.tellStopped
+    :return: [(method, params)], pages of the queue, all pages if limit is None
+    """
+    if limit is not None:
+        return [(method, [offset, limit, keys])]
+    return [(method, [offset, WAITING_PAGE_SIZE, keys])]
+
+
+def fetch_pages(client, calls, fetch_all=True):
+    """
+    Fetch the pages in one multicall, fetch further pages of the full queues
+    :param fetch_all: bool, the calls are the first pages of the whole queues, as
+        `queue_pages` without limit, False: only the requested pages
+    :return: [dict], task structs
+    """
+    structs = []
+    while calls:
+        more = []
+        for (method, params), r in zip(calls, multicall(client, calls)):
+            if isinstance(r, aria2p.client.ClientException):
+                raise r
+            structs.extend(r)
+            if fetch_all and method != client.TELL_ACTIVE and len(r) == params[1]:
+                more.append((method, [params[0] + len(r), *params[1:]]))
+        calls = more
+    return structs
+
+
+def fetch_files(client, structs):
+    """fetch the files of non-BitTorrent tasks in one multicall, their name is taken from the files"""
+    no_name = [t for t in structs if not t.get("bittorrent", {}).get("info")]
+    responses = multicall(client, [(client.GET_FILES, [t["gid"]]) for t in no_name])
+    for struct, r in zip(no_name, responses):
+        if not isinstance(r, aria2p.client.ClientException):
+            struct["files"] = r
+
+
+def list_row(struct):
+    """raw values of a task struct fetched with LIST_KEYS"""
+    total = int(struct["totalLength"])
+    completed = int(struct["completedLength"])
+    speed = int(struct["downloadSpeed"])
+    return {
+        "gid": struct["gid"],
+        "status": struct["status"],
+        "totalLength": total,
+        "completedLength": completed,
+        "progress": completed / total * 100 if total else 0.0,
+        "downloadSpeed": speed,
+        "uploadSpeed": int(struct["uploadSpeed"]),
+        "eta": int((total - completed) / speed) if speed else None,
+        "name": list_name(struct),
+    }
+
+
+def list_name(struct):
+    """same as aria2p.Download.name, from the raw struct"""
+    info = struct.get("bittorrent", {}).get("info")
+    if info:
+        return info["name"]
+    files = struct.get("files")
+    if not files:
+        return ""
+    path = files[0]["path"]
+    if path.startswith("[METADATA]"):
+        return path
+    if not path:
+        uris = files[0].get("uris")
+        return uris[0]["uri"] if uris else ""
+    directory = struct.get("dir", "").rstrip("/")
+    if directory and path.startswith(f"{directory}/"):
+        return Path(path[len(directory) + 1 :]).parts[0]
+    return path
+
+
+def eta_string(seconds):
+    if seconds is None:
+        return "-"
+    return aria2p.utils.human_readable_timedelta(timedelta(seconds=seconds))
+
+
+def select_tasks(client, statuses, patterns=()):
+    """
+    :param statuses: [str], only the queues holding these statuses are fetched
+    :param patterns: [str], glob patterns of the task name, case-insensitive, any of them
+    :return: {gid: status}, in the order of the queues
+    """
+    calls = []
+    if "active" in statuses:
+        calls.append((client.TELL_ACTIVE, [SELECT_KEYS]))
+    if {"waiting", "paused"} & set(statuses):
+        calls.extend(queue_pages(client.TELL_WAITING, keys=SELECT_KEYS))
+    if set(STOPPED_STATUS) & set(statuses):
+        calls.extend(queue_pages(client.TELL_STOPPED, keys=SELECT_KEYS))
+    structs = fetch_pages(client, calls, fetch_all=True)
+    structs = [t for t in structs if t["status"] in statuses]
+    if patterns:
+        fetch_files(client, structs)
+        matcher = re.compile(
+            "|".join(fnmatch_translate(p) for p in patterns), re.IGNORECASE
+        )
+        structs = [t for t in structs if matcher.match(list_name(t))]
+    return {t["gid"]: t["status"] for t in structs}
+
+
+def tell_statuses(client, gids):
+    """
+    :return: {gid: status or aria2p.client.ClientException}, in one multicall
+    """
+    gids = list(gids)
+    responses = multicall(
+        client, [(client.TELL_STATUS, [gid, ["gid", "status"]]) for gid in gids]
+    )
+    return {
+        gid: r if isinstance(r, aria2p.client.ClientException) else r["status"]
+        for gid, r in zip(gids, responses)
+    }
+
+
+def act_on_tasks(client, tasks, method_of):
+    """
+    Call a method on each task in one multicall, confirm with one more multicall
+    :param tasks: {gid: status}, status is None if unknown, a ClientException if not found
+    :param method_of: callable(status) -> str, the method to call on the task
+    :return: [(gid, result or ClientException, status after the call or ClientException)]
+    """
+    gids = [
+        gid
+        for gid, s in tasks.items()
+        if not isinstance(s, aria2p.client.ClientException)
+    ]
+    responses = dict(
+        zip(
+            gids,
+            multicall(client, [(method_of(tasks[gid]), [gid]) for gid in gids]),
+        )
+    )
+    done = [
+        gid
+        for gid, r in responses.items()
+        if not isinstance(r, aria2p.client.ClientException)
+    ]
+    statuses = tell_statuses(client, done)
+    return [
+        (gid, responses.get(gid, status), statuses.get(gid, status))
+        for gid, status in tasks.items()
+    ]
+
+
+def selected_tasks(client, gids, statuses, patterns, default_statuses):
+    """
+    The gids and the tasks selected by status and name
+    :param default_statuses: [str], statuses to select by name when no status is given
+    :return: {gid: status}, status is None for the gids not selected
+    """
+    if not (gids or statuses or patterns):
+        raise click.UsageError("No task selected, give gids, --status or --name.")
+    tasks = {}
+    if statuses or patterns:
+        tasks = select_tasks(client, statuses or default_statuses, patterns)
+    for gid in gids:
+        tasks.setdefault(gid, None)
+    return tasks
+
+
+def task_selection(func):
+    """options of the commands acting on tasks"""
+    func = click.argument("gids", nargs=-1)(func)
+    func = click.option(
+        "--dry-run", is_flag=True, help="Show the selected tasks only."
+    )(func)
+    func = click.option(
+        "-n",
+        "--name",
+        "patterns",
+        multiple=True,
+        help="Select the tasks by name, glob pattern, case-insensitive. Repeatable.",
+    )(func)
+    func = click.option(
+        "-s",
+        "--status",
+        "statuses",
+        type=click.Choice(TASK_STATUS),
+        multiple=True,
+        help="Select the tasks by status. Repeatable.",
+    )(func)
+    return func
+
+
+def echo_selected(tasks):
+    """:param tasks: see `selected_tasks`"""
+    echo_results((gid, status, status or "-") for gid, status in tasks.items())
+
+
+def echo_results(results):
+    for gid, result, status in results:
+        if isinstance(result, aria2p.client.ClientException):
+            click.echo(f"{gid:<17} failed: {result.message}")
+        elif isinstance(status, aria2p.client.ClientException):
+            click.echo(f"{gid:<17} gone")  # the result is removed
         else:
-            matched = fnmatch(filename, p)
-            pat = p
-        if matched:
-            return matched, pat
-    else:
-        return False, None
+            click.echo(f"{gid:<17} {status}")
+
+
+def task_index(
+    client, index_cache=None, index_cache_ttl=INDEX_CACHE_MAX_AGE, dry_run=False
+):
+    """
+    :param dry_run: bool, trust the cached index as is, and go on without the index
+        if aria2 is not reachable, a dry run works offline
+    :return: TaskIndex, None if not available in a dry run
+    """
+    index = None
+    if index_cache:
+        index = TaskIndex.load(index_cache, client.server, index_cache_ttl)
+    if index is not None:
+        if dry_run:
+            index.cached = False  # not confirmed by aria2
+        return index
+    try:
+        return TaskIndex.fetch(client)
+    except (requests.exceptions.RequestException, aria2p.client.ClientException) as e:
+        if not dry_run:
+            raise
+        click.secho(
+            f"duplicates not checked, fetch the tasks failed: {e}",
+            err=True,
+            fg="yellow",
+        )
+        return None
+
+
+def find_duplicate(client, index, info_hash=None, uri=None):
+    """
+    :param client: aria2p.Client
+    :param index: TaskIndex
+    :return: (gid, status) of the queued task, None if not a duplicate
+    """
+    gid = index.lookup(info_hash, uri)
+    if gid is None:
+        return None
+    status = index.confirm(client, [gid]).get(gid)
+    return (gid, status) if status else None
+
+
+def skip_duplicates(client, index, pending, results):
+    """
+    Drop the pending tasks already queued in aria2 or repeated in the input
+    :param pending: [(uri index, call, info_hash, uri)]
+    :param results: {uri index: (gid, error)}, updated with the duplicates
+    :return: [(uri index, call, info_hash, uri)]
+    """
+    hits = {index.lookup(info_hash, uri) for _, _, info_hash, uri in pending}
+    hits.discard(None)
+    index.confirm(client, hits)  # drop the tasks gone since the index is cached
+    unique = []
+    for idx, call, info_hash, uri in pending:
+        gid = index.lookup(info_hash, uri)
+        if gid is not None:
+            if gid.startswith("#"):
+                results[idx] = (None, "repeated in the input")
+            else:
+                results[idx] = (None, f"duplicate of {gid} ({index.status[gid]})")
+            continue
+        # placeholder of the input, replaced by the gid once submitted
+        index.add(f"#{idx}", "new", info_hash, [uri] if uri else ())
+        unique.append((idx, call, info_hash, uri))
+    return unique
+
+
+def add_bulk(
+    aria2,
+    uris,
+    excludes,
+    options,
+    dry_run=False,
+    jobs=None,
+    batch_size=BULK_BATCH_SIZE,
+    index=None,
+):
+    """
+    Parse torrent files in a process pool, submit addTorrent/addUri in batched multicall
+    :param aria2: aria2p.API
+    :param uris: [str], torrent files or URIs
+    :param excludes: ExcludeMatcher
+    :param options: dict, options of new tasks
+    :param jobs: int, number of worker processes, default to the number of CPUs
+    :param batch_size: int, calls per multicall request
+    :param index: TaskIndex, skip the duplicates if given
+    :return: [(uri, gid, error)]
+    """
+    client = aria2.client
+    results = {}  # uri index -> (gid, error)
+    torrent_files = []
+    pending = []  # [(uri index, (method, params), info_hash, uri)]
+    sizes = {}  # uri index -> selected file size of torrent
+    for idx, uri in enumerate(uris):
+        if is_supported_uri(uri):
+            task_opts = dict(options)
+            info_hash = None
+            if is_magnet(uri):
+                task_opts["dir"] = str(Path(task_opts.get("dir", "")) / ".tmp")
+                info_hash = magnet_info_hash(uri)
+            pending.append((idx, (client.ADD_URI, [[uri], task_opts]), info_hash, uri))
+        elif is_torrent_file(uri):
+            torrent_files.append((idx, uri))
+        elif is_aria2_file(uri):
+            click.secho(f"recover {uri}", fg="cyan")
+            recovered = prepare_control_file(uri, excludes)
+            for line in recovered["output"]:
+                click.echo(line)
+            if recovered["error"]:
+                results[idx] = (None, recovered["error"])
+                continue
+            call = recovery_call(client, recovered, options)
+            pending.append((idx, call, recovered["info_hash"], None))
+        else:
+            results[idx] = (None, "unknown file")
+
+    if torrent_files:
+        from concurrent.futures import ProcessPoolExecutor
+
+        jobs = jobs or os.cpu_count() or 1
+        with ProcessPoolExecutor(jobs) as executor:
+            prepared = executor.map(
+                partial(prepare_torrent, excludes=excludes),
+                [uri for _, uri in torrent_files],
+                chunksize=max(1, len(torrent_files) // (jobs * 4)),
+            )
+            for (idx, uri), item in zip(torrent_files, prepared):
+                click.secho(f"add {uri}", fg="cyan")
+                for line in item["output"]:
+                    click.echo(line)
+                if item["error"]:
+                    results[idx] = (None, item["error"])
+                    continue
+                sizes[idx] = item["size"]
+                task_opts = dict(options)
+                task_opts["dir"] = str(Path(task_opts.get("dir", "")) / ".tmp")
+                if item["select_file"]:
+                    task_opts["select-file"] = item["select_file"]
+                call = (client.ADD_TORRENT, [item["torrent"], [], task_opts])
+                pending.append((idx, call, item["info_hash"], None))
+    if index is not None:
+        pending = skip_duplicates(client, index, pending, results)
+    estimated_file_size = sum(sizes.get(idx, 0) for idx, _, _, _ in pending)
+    click.secho(f"Estimated file size (torrent): {convert_bytes(estimated_file_size)}")
+
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start : start + batch_size]
+        if dry_run:
+            responses = [None] * len(batch)
+        else:
+            try:
+                responses = multicall(client, [call for _, call, _, _ in batch])
+            except aria2p.client.ClientException as e:  # the whole request failed
+                responses = [e] * len(batch)
+        for (idx, _, info_hash, uri), r in zip(batch, responses):
+            if isinstance(r, aria2p.client.ClientException):
+                results[idx] = (None, r.message)
+            else:
+                results[idx] = (r, None)
+            if index is not None:
+                index.discard(f"#{idx}")
+                if r and not isinstance(r, aria2p.client.ClientException):
+                    index.add(r, "waiting", info_hash, [uri] if uri else ())
+    return [(uri, *results[idx]) for idx, uri in enumerate(uris)]
+
+
+def parse_batch_line(line):
+    """
+    :param line: str, "<command> <gid>..." or a JSON line,
+        {"command": "pause", "gid": "..."} or {"method": "aria2.pause", "params": [...]}
+    :return: [(command, gid, (method, params))], the calls of the line
+    """
+    if line.startswith("{"):
+        request = json.loads(line)
+        if "method" in request:
+            return [
+                (
+                    request["method"],
+                    None,
+                    (request["method"], request.get("params", [])),
+                )
+            ]
+        args = request.get("args", [])
+        gids = request.get("gids") or ([request["gid"]] if "gid" in request else [])
+        return batch_calls(request["command"], gids, args)
+    command, *args = shlex.split(line)
+    if command in BATCH_GID_ARGS:  # all arguments are gids
+        return batch_calls(command, args, [])
+    if command == "add":  # all arguments are URIs of one download
+        return batch_calls(command, [], args)
+    return batch_calls(command, args[:1], args[1:])
+
+
+def batch_calls(command, gids, args):
+    if command not in BATCH_COMMANDS:
+        raise ValueError(f"unknown command: {command}")
+    check_batch_args(command, gids, args)
+    method, make_params = BATCH_COMMANDS[command]
+    if not gids:
+        return [(command, None, (method, make_params(None, args)))]
+    return [(command, gid, (method, make_params(gid, args))) for gid in gids]
+
+
+def check_batch_args(command, gids, args):
+    """raise ValueError with the usage of the command if the arguments do not fit it"""
+    usage, min_args, max_args = BATCH_USAGE.get(command, ("<gid>...", 0, 0))
+    valid = (
+        bool(gids) == (command != "add")
+        and min_args <= len(args)
+        and (max_args is None or len(args) <= max_args)
+    )
+    if valid and command == "move":
+        valid = re.fullmatch(r"-?\d+", str(args[0])) and (
+            len(args) < 2 or args[1] in ("POS_SET", "POS_CUR", "POS_END")
+        )
+    elif valid and command == "option":
+        valid = all("=" in arg for arg in args)
+    if not valid:
+        raise ValueError(f"{command}: expected {usage}")
+
+
+def change_option_params(gid, args):
+    return [gid, dict(arg.split("=", 1) for arg in args)]
+
+
+# command -> (method, params(gid, args))
+BATCH_COMMANDS = {
+    "info": ("aria2.tellStatus", lambda gid, args: [gid, *args[:1]]),
+    "pause": ("aria2.pause", lambda gid, args: [gid]),
+    "force-pause": ("aria2.forcePause", lambda gid, args: [gid]),
+    "resume": ("aria2.unpause", lambda gid, args: [gid]),
+    "remove": ("aria2.remove", lambda gid, args: [gid]),
+    "force-remove": ("aria2.forceRemove", lambda gid, args: [gid]),
+    "remove-result": ("aria2.removeDownloadResult", lambda gid, args: [gid]),
+    "move": (
+        "aria2.changePosition",
+        lambda gid, args: [gid, int(args[0]), args[1] if len(args) > 1 else "POS_SET"],
+    ),
+    "option": ("aria2.changeOption", change_option_params),
+    "add": ("aria2.addUri", lambda gid, args: [args]),
+}
+# command -> (usage, min args, max args or None), the others take gids only
+BATCH_USAGE = {
+    "info": ("<gid>... [keys]", 0, 1),
+    "move": ("<gid> <pos> [POS_SET|POS_CUR|POS_END]", 1, 2),
+    "option": ("<gid> key=value...", 1, None),
+    "add": ("<uri>...", 1, None),
+}
+# commands taking gids only, "pause gid1 gid2"
+BATCH_GID_ARGS = {
+    "info",
+    "pause",
+    "force-pause",
+    "resume",
+    "remove",
+    "force-remove",
+    "remove-result",
+}
+
+
+class CliContext(dict):
+    """ctx.obj, "aria2" is created on first use, subcommands without RPC skip aria2p"""
+
+    def __missing__(self, key):
+        if key != "aria2":
+            raise KeyError(key)
+        from aria2rpc.client import create_client
+
+        client = create_client(
+            self["config"],
+            self["host"],
+            self["port"],
+            self["token"],
+            **self["client_options"],
+        )
+        self["aria2"] = aria2p.API(client)
+        return self["aria2"]
 
 
 @click.group()
@@ -132,9 +839,20 @@ def match_remove_pattern(filename, exclude_patterns):
 @click.option("--host", help="Aria2 JSON-RPC server host.")
 @click.option("--port", help="Aria2 JSON-RPC server port.")
 @click.option("--token", help="RPC SECRET string.")
+@click.option(
+    "--transport",
+    type=click.Choice(TRANSPORTS),
+    help="Transport of JSON-RPC requests, over a persistent connection. [default: http]",
+)
+@click.option(
+    "--rpc-timeout", type=float, help="Seconds to wait for a JSON-RPC response."
+)
+@click.option("--rpc-retries", type=int, help="Retries of failed JSON-RPC connections.")
 @click.option("-v", "--verbose", count=True, help="Increase output verbosity.")
 @click.pass_context
-def cli(ctx, config_file, host, port, token, verbose):
+def cli(
+    ctx, config_file, host, port, token, transport, rpc_timeout, rpc_retries, verbose
+):
     """Aria2 RPC Client"""
     global FEATURE_DEBUG
     FEATURE_DEBUG = verbose >= 3
@@ -152,19 +870,17 @@ def cli(ctx, config_file, host, port, token, verbose):
     ]
     config = load_aria2_config(config_file, guess_paths=guess_paths)
 
-    ctx.ensure_object(dict)
+    ctx.ensure_object(CliContext)
     ctx.obj["host"] = host
     ctx.obj["port"] = port
     ctx.obj["token"] = token
     ctx.obj["config"] = config
     ctx.obj["guess_paths"] = guess_paths
-    ctx.obj["aria2"] = aria2p.API(
-        aria2p.Client(
-            host=host or config.get("host"),
-            port=port or config.get("port"),
-            secret=token or config.get("token"),
-        )
-    )
+    ctx.obj["client_options"] = {
+        "transport": transport,
+        "timeout": rpc_timeout,
+        "retries": rpc_retries,
+    }
     ctx.obj["logger"] = logger
 
 
@@ -191,6 +907,41 @@ def cli(ctx, config_file, host, port, token, verbose):
 @click.option(
     "--dry-run", is_flag=True, help="Test add function. Not submit to aria2-rpc"
 )
+@click.option(
+    "--bulk",
+    is_flag=True,
+    help="Parse torrent files in parallel, submit tasks in batched multicall requests.",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=int,
+    help="Number of processes parsing torrent files in bulk mode. [default: number of CPUs]",
+)
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=BULK_BATCH_SIZE,
+    help="Number of tasks submitted per multicall request in bulk mode.",
+    show_default=True,
+)
+@click.option(
+    "--allow-duplicate",
+    is_flag=True,
+    help="Add the task even if its info hash or URI is already in the queue.",
+)
+@click.option(
+    "--index-cache",
+    type=click.Path(dir_okay=False),
+    help="Cache file of the task index, speed up repeated imports.",
+)
+@click.option(
+    "--index-cache-ttl",
+    type=int,
+    default=INDEX_CACHE_MAX_AGE,
+    help="Seconds the cached task index is reused.",
+    show_default=True,
+)
 @click.argument("torrent-files-or-uris", nargs=-1, required=True)
 @click.pass_context
 def add(
@@ -200,11 +951,18 @@ def add(
     exclude_file,
     set_pause,
     dry_run,
+    bulk,
+    jobs,
+    batch_size,
+    allow_duplicate,
+    index_cache,
+    index_cache_ttl,
     torrent_files_or_uris,
 ):
     """Add tasks.
 
-    Support: *.torrent, magnet://, http://, https://, ftp://, ftps://, sftp://
+    Support: *.torrent, magnet://, http://, https://, ftp://, ftps://, sftp://,
+    *.aria2 (recover the task of an aria2 control file)
     """
     aria2 = ctx.obj["aria2"]
     logger = ctx.obj["logger"]
@@ -236,60 +994,129 @@ def add(
     # exclude list
     exclude_patterns = build_exclude_list(exclude_file)
 
+    # index of queued tasks, to skip the duplicates
+    index = None
+    if not allow_duplicate:
+        index = task_index(aria2.client, index_cache, index_cache_ttl, dry_run)
+
+    if bulk:
+        results = add_bulk(
+            aria2,
+            torrent_files_or_uris,
+            exclude_patterns,
+            task_options(download_dir, set_pause, allow_overwrite),
+            dry_run=dry_run,
+            jobs=jobs,
+            batch_size=batch_size,
+            index=index,
+        )
+        if index is not None and index_cache and not dry_run:
+            index.save(index_cache)
+        failed = 0
+        for uri, gid, error in results:
+            if error:
+                failed += 1
+                click.secho(f'skip "{uri}", reason: {error}', err=True, fg="yellow")
+            else:
+                click.echo(f"{gid or '-':<17} {uri}")
+        click.echo(f"{len(results) - failed} added, {failed} skipped")
+        return
+
     estimated_file_size = 0
     for uri in torrent_files_or_uris:
         logger.info(f"Add task {uri}")
         # init option
-        options = {
-            "continue": "true",
-        }
-        if download_dir:
-            options["dir"] = str(Path(download_dir))
-        if set_pause:
-            options["pause"] = str(set_pause).lower()
-        if allow_overwrite:
-            options["allow-overwrite"] = str(allow_overwrite).lower()
+        options = task_options(download_dir, set_pause, allow_overwrite)
 
-        # TODO: check task in queue
         if is_supported_uri(uri):
+            torrent_hash = None
             if is_magnet(uri):
                 options["dir"] = str(Path(options.get("dir", "")) / ".tmp")
+                torrent_hash = magnet_info_hash(uri)
+            duplicate = index and find_duplicate(aria2.client, index, torrent_hash, uri)
+            if duplicate:
+                click.secho(
+                    f'skip "{uri}", reason: duplicate of {duplicate[0]} ({duplicate[1]})',
+                    err=True,
+                    fg="yellow",
+                )
+                continue
             # aria2.addUri([secret, ]uris[, options[, position]])
             # @see https://aria2.github.io/manual/en/html/aria2c.html#aria2.addUri
             if not dry_run:
                 task = aria2.add_uris([uri], options)
                 click.echo(f"Create task {task.gid}")
+                if index is not None:
+                    index.add(task.gid, "waiting", torrent_hash, [uri])
         elif is_torrent_file(uri):
             click.secho(f"add {uri}", fg="cyan")
             options["dir"] = str(Path(options.get("dir", "")) / ".tmp")
             try:
-                # setup option.select-file
-                with open(uri, "rb") as f:
-                    # parse torrent file
-                    torrent = TorrentFileParser(f).parse()
+                # parse torrent file
+                with TorrentMetadata.open(uri) as torrent:
+                    torrent_hash = torrent.info_hash
+                    duplicate = index and find_duplicate(
+                        aria2.client, index, torrent_hash
+                    )
+                    if duplicate:
+                        click.secho(
+                            f'skip torrent file: "{uri}", reason: duplicate of {duplicate[0]} ({duplicate[1]})',
+                            err=True,
+                            fg="yellow",
+                        )
+                        continue
+                    # setup option.select-file
                     selected_file_idx, selected_file_size = torrent_filter_file(
-                        torrent["info"], exclude_patterns
+                        torrent, exclude_patterns
                     )
-                    if selected_file_idx:
-                        options["select-file"] = ",".join(selected_file_idx)
-                    estimated_file_size += selected_file_size
-                    f.seek(0)  # rewind the file
+                if selected_file_idx:
+                    options["select-file"] = ",".join(selected_file_idx)
+                estimated_file_size += selected_file_size
                 # aria2.addTorrent([secret, ]torrent[, uris[, options[, position]]])
                 # @see https://aria2.github.io/manual/en/html/aria2c.html#aria2.addTorrent
                 if not dry_run:
                     task = aria2.add_torrent(uri, [], options)
                     click.echo(f"Create task {task.gid}")
-            except InvalidTorrentDataException as e:
+                    if index is not None:
+                        index.add(task.gid, "waiting", torrent_hash)
+            except BencodeError as e:
                 click.secho(
                     f'skip torrent file: "{uri}", reason: {e}', err=True, fg="yellow"
                 )
                 continue
         elif is_aria2_file(uri):
-            # TODO: parse .aria2 file and add magnet URI
-            click.secho(f'Not currently supported file "{uri}"', err=True, fg="red")
+            click.secho(f"recover {uri}", fg="cyan")
+            recovered = prepare_control_file(uri, exclude_patterns)
+            for line in recovered["output"]:
+                click.echo(line)
+            if recovered["error"]:
+                click.secho(
+                    f'skip control file: "{uri}", reason: {recovered["error"]}',
+                    err=True,
+                    fg="yellow",
+                )
+                continue
+            torrent_hash = recovered["info_hash"]
+            duplicate = index and find_duplicate(aria2.client, index, torrent_hash)
+            if duplicate:
+                click.secho(
+                    f'skip control file: "{uri}", reason: duplicate of {duplicate[0]} ({duplicate[1]})',
+                    err=True,
+                    fg="yellow",
+                )
+                continue
+            if not dry_run:
+                gid = aria2.client.call(
+                    *recovery_call(aria2.client, recovered, options)
+                )
+                click.echo(f"Create task {gid}")
+                if index is not None:
+                    index.add(gid, "waiting", torrent_hash)
         else:
             click.secho(f'Unknown file "{uri}"', err=True, fg="red")
     click.secho(f"Estimated file size (torrent): {convert_bytes(estimated_file_size)}")
+    if index is not None and index_cache and not dry_run:
+        index.save(index_cache)
 
 
 @cli.command(name="list")
@@ -333,29 +1160,82 @@ def add(
     default=False,
     help="display complete/stopped tasks.",
 )
+@click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(["table", "tsv", "json"]),
+    default="table",
+    help="Output format, tsv/json print raw values for scripting.",
+    show_default=True,
+)
+@click.option(
+    "--offset",
+    type=click.IntRange(min=0),
+    default=0,
+    help="Skip tasks of each queue, passed to tellWaiting/tellStopped.",
+    show_default=True,
+)
+@click.option(
+    "--limit",
+    type=click.IntRange(min=1),
+    help="Max tasks of each queue, passed to tellWaiting/tellStopped.",
+)
 @click.pass_context
-def list_queue(ctx, show_all, show_active, show_waiting, show_paused, show_stopped):
+def list_queue(
+    ctx,
+    show_all,
+    show_active,
+    show_waiting,
+    show_paused,
+    show_stopped,
+    output_format,
+    offset,
+    limit,
+):
     """Show status of tasks"""
-    aria2 = ctx.obj["aria2"]
+    client = ctx.obj["aria2"].client
 
     show_active = show_active or not (show_waiting or show_stopped)
-    for download in aria2.get_downloads():
-        if (
-            show_all
-            or (show_active and download.is_active)
-            or (show_waiting and download.is_waiting)
-            or (show_paused and download.is_paused)
-            or (show_stopped and download.is_complete)
-        ):
-            print(
-                f"{download.gid:<17} "
-                f"{download.status:<9} "
-                f"{download.progress_string():>8} "
-                f"{download.download_speed_string():>12} "
-                f"{download.upload_speed_string():>12} "
-                f"{download.eta_string():>8}  "
-                f"{download.name}"
-            )
+    statuses = set()
+    calls = []
+    if show_all or show_active:
+        calls.append((client.TELL_ACTIVE, [LIST_KEYS]))
+        statuses.add("active")
+    if show_all or show_waiting or show_paused:
+        calls.extend(queue_pages(client.TELL_WAITING, offset, limit))
+        if show_all or show_waiting:
+            statuses.add("waiting")
+        if show_all or show_paused:
+            statuses.add("paused")
+    if show_all or show_stopped:
+        calls.extend(queue_pages(client.TELL_STOPPED, offset, limit))
+        statuses.update(STOPPED_STATUS if show_all else ["complete"])
+    structs = fetch_pages(client, calls, fetch_all=limit is None)
+    if limit is not None or offset:  # tellActive has no paging
+        active = [t["gid"] for t in structs if t["status"] == "active"]
+        keep = set(active[offset : None if limit is None else offset + limit])
+        structs = [t for t in structs if t["status"] != "active" or t["gid"] in keep]
+    structs = [t for t in structs if t["status"] in statuses]
+    fetch_files(client, structs)
+
+    rows = [list_row(struct) for struct in structs]
+    if output_format == "json":
+        output = json.dumps(rows, ensure_ascii=False, indent=2)
+    elif output_format == "tsv":
+        output = "\n".join("\t".join(str(row[k]) for k in LIST_COLUMNS) for row in rows)
+    else:
+        output = "\n".join(
+            f"{row['gid']:<17} "
+            f"{row['status']:<9} "
+            f"{row['progress']:>7.2f}% "
+            f"{aria2p.utils.human_readable_bytes(row['downloadSpeed'], delim=' ', postfix='/s'):>12} "
+            f"{aria2p.utils.human_readable_bytes(row['uploadSpeed'], delim=' ', postfix='/s'):>12} "
+            f"{eta_string(row['eta']):>8}  "
+            f"{row['name']}"
+            for row in rows
+        )
+    if output:
+        click.echo(output)  # one write
 
 
 @cli.command()
@@ -376,37 +1256,45 @@ def info(ctx, gid):
 
 
 @cli.command()
-@click.argument("gids", nargs=-1)
+@click.option(
+    "-f", "--force", is_flag=True, help="Remove without contacting the trackers."
+)
+@task_selection
 @click.pass_context
-def remove(ctx, gids):
-    """TODO: Remove a task."""
-    aria2 = ctx.obj["aria2"]
-    downloads = [aria2.get_download(gid) for gid in gids]
-    response = aria2.remove(downloads)
-    for r in response:
-        if isinstance(r, aria2p.client.ClientException):
-            print(f"{r=} {r.message}")
-        else:
-            print(f"{r=}")
+def remove(ctx, force, statuses, patterns, dry_run, gids):
+    """Remove tasks, the results of stopped tasks are removed from memory"""
+    client = ctx.obj["aria2"].client
+    tasks = selected_tasks(client, gids, statuses, patterns, TASK_STATUS)
+    unknown = [gid for gid, status in tasks.items() if status is None]
+    tasks.update(tell_statuses(client, unknown))  # stopped ones need another method
+    if dry_run:
+        echo_selected(tasks)
+        return
+    method = client.FORCE_REMOVE if force else client.REMOVE
+    echo_results(
+        act_on_tasks(
+            client,
+            tasks,
+            lambda s: client.REMOVE_DOWNLOAD_RESULT if s in STOPPED_STATUS else method,
+        )
+    )
 
 
 @cli.command()
-@click.argument("gids", nargs=-1)
+@click.option(
+    "-f", "--force", is_flag=True, help="Pause without contacting the trackers."
+)
+@task_selection
 @click.pass_context
-def pause(ctx, gids):
-    """Pause a running/waiting tasks"""
-    aria2 = ctx.obj["aria2"]
-    downloads = [aria2.get_download(gid) for gid in gids]
-    response = aria2.pause(downloads)
-    for r in response:
-        if isinstance(r, aria2p.client.ClientException):
-            print(f"{r=} {r.message}")
-        else:
-            print(f"{r=}")
-    for download in downloads:
-        print(
-            f"{download.gid=}, {download.status=}, {download.live.status=}, {download.status=}"
-        )
+def pause(ctx, force, statuses, patterns, dry_run, gids):
+    """Pause running/waiting tasks"""
+    client = ctx.obj["aria2"].client
+    tasks = selected_tasks(client, gids, statuses, patterns, ["active", "waiting"])
+    if dry_run:
+        echo_selected(tasks)
+        return
+    method = client.FORCE_PAUSE if force else client.PAUSE
+    echo_results(act_on_tasks(client, tasks, lambda s: method))
 
 
 @cli.command()
@@ -419,22 +1307,16 @@ def pause_all(ctx):
 
 
 @cli.command()
-@click.argument("gids", nargs=-1)
+@task_selection
 @click.pass_context
-def resume(ctx, gids):
+def resume(ctx, statuses, patterns, dry_run, gids):
     """Resume paused tasks"""
-    aria2 = ctx.obj["aria2"]
-    downloads = [aria2.get_download(gid) for gid in gids]
-    response = aria2.resume(downloads)
-    for r in response:
-        if isinstance(r, aria2p.client.ClientException):
-            print(f"{r=} {r.message}")
-        else:
-            print(f"{r=}")
-    for download in downloads:
-        print(
-            f"{download.gid=}, {download.status=}, {download.live.status=}, {download.status=}"
-        )
+    client = ctx.obj["aria2"].client
+    tasks = selected_tasks(client, gids, statuses, patterns, ["paused"])
+    if dry_run:
+        echo_selected(tasks)
+        return
+    echo_results(act_on_tasks(client, tasks, lambda s: client.UNPAUSE))
 
 
 @cli.command()
@@ -455,6 +1337,74 @@ def purge(ctx):
     click.echo(response)
 
 
+@cli.command()
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=BULK_BATCH_SIZE,
+    help="Max calls per multicall request.",
+    show_default=True,
+)
+@click.argument("commands", type=click.File("r"), default="-")
+@click.pass_context
+def batch(ctx, batch_size, commands):
+    """Run commands from a file or stdin over one connection.
+
+    One command per line, "<command> <gid>... [args]" or a JSON line. Results are
+    streamed as JSON lines. Commands: info, pause, force-pause, resume, remove,
+    force-remove, remove-result, move <gid> <pos> [POS_SET|POS_CUR|POS_END],
+    option <gid> key=value..., add <uri>..., or {"method": ..., "params": [...]}.
+    """
+    client = ctx.obj["aria2"].client
+    interactive = commands.isatty()
+    pending = []  # [(line number, command, gid, call)]
+
+    def emit(result):
+        click.echo(json.dumps(result, ensure_ascii=False))
+
+    def flush():
+        if not pending:
+            return
+        try:
+            responses = multicall(client, [call for *_, call in pending])
+        except aria2p.client.ClientException as e:  # the whole request failed
+            responses = [e] * len(pending)
+        for (line_number, command, gid, _), r in zip(pending, responses):
+            result = {"line": line_number, "command": command, "gid": gid}
+            if isinstance(r, aria2p.client.ClientException):
+                result["error"] = {"code": r.code, "message": r.message}
+            else:
+                result["result"] = r
+            emit(result)
+        pending.clear()
+
+    for line_number, line in enumerate(commands, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            calls = parse_batch_line(line)
+        except (ValueError, KeyError, IndexError) as e:
+            flush()
+            emit({"line": line_number, "error": {"code": None, "message": str(e)}})
+            continue
+        for command, gid, call in calls:
+            if call[0].startswith("system."):  # not allowed in a multicall
+                flush()
+                try:
+                    result = {"result": client.call(*call)}
+                except aria2p.client.ClientException as e:
+                    result = {"error": {"code": e.code, "message": e.message}}
+                emit({"line": line_number, "command": command, "gid": gid, **result})
+                continue
+            pending.append((line_number, command, gid, call))
+            if len(pending) >= batch_size:
+                flush()
+        if interactive:
+            flush()
+    flush()
+
+
 @cli.command()
 @click.pass_context
 def set_priority(ctx):
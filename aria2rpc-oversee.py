@@ -6,20 +6,39 @@ import click_log
 import logging
 import requests.exceptions
 import signal
+import threading
+import time
 
+from functools import partial
 from threading import Event
 
 from aria2rpc import (
+    aria2_endpoints,
     load_aria2_config,
     Aria2QueueManager,
+    AsyncAria2QueueManager,
+    ASYNC_MAX_WORKERS,
+    EXIT_CHECK_INTERVAL,
+    TRANSPORTS,
     LOG_LEVELS,
     DEFAULT_ARIA2_CONFIG,
     DEFAULT_ARIA2_HOST,
     DEFAULT_ARIA2_PORT,
 )
+from aria2rpc.client import create_client
+from aria2rpc.events import Aria2EventWatcher
+from aria2rpc.fleet import endpoint_filename, Rebalancer
+from aria2rpc.instrument import Instrumentation, JsonLogHook
+from aria2rpc.metrics import Metrics
+from aria2rpc.store import SampleStore
+from aria2rpc.strategy import STRATEGIES, DEFAULT_STRATEGY
 
 
 LOG_FORMAT = "%(asctime)s - %(name)s - [%(levelname)s] %(message)s"
+FLEET_LOG_FORMAT = (
+    "%(asctime)s - %(threadName)s - %(name)s - [%(levelname)s] %(message)s"
+)
+FAILURE_RETRY_DELAY = 5
 exit_event = Event()
 
 
@@ -51,9 +70,144 @@ def register_single():
     "--port", help="Aria2 JSON-RPC server port. default: {}".format(DEFAULT_ARIA2_PORT)
 )
 @click.option("--token", help="RPC SECRET string")
+@click.option(
+    "--transport",
+    type=click.Choice(TRANSPORTS),
+    help="Transport of JSON-RPC requests, over a persistent connection. [default: http]",
+)
+@click.option(
+    "--rpc-timeout", type=float, help="Seconds to wait for a JSON-RPC response."
+)
+@click.option("--rpc-retries", type=int, help="Retries of failed JSON-RPC connections.")
 @click.option("-t", "--interval", default=300, help="Check interval")
+@click.option(
+    "--stall-window",
+    default=3,
+    help="Samples of speed history per task, "
+    "a task is stalled if it is too slow over the whole window.",
+    show_default=True,
+)
+@click.option(
+    "--stall-speed",
+    default=0,
+    help="A task is stalled if its average speed is not above it, bytes/s.",
+    show_default=True,
+)
+@click.option(
+    "--strategy",
+    type=click.Choice(list(STRATEGIES)),
+    default=DEFAULT_STRATEGY,
+    help="Strategy of task swap. "
+    + "; ".join(f"{name}: {cls.description}" for name, cls in STRATEGIES.items()),
+    show_default=True,
+)
+@click.option(
+    "--probe",
+    "probe_size",
+    default=0,
+    help="Waiting tasks never measured to probe per cycle. "
+    "They run along with the active tasks for --probe-window seconds, "
+    "then the slowest tasks are swapped out. 0: disable.",
+    show_default=True,
+)
+@click.option(
+    "--probe-window",
+    default=30,
+    help="Seconds to measure the speed of probed tasks.",
+    show_default=True,
+)
+@click.option(
+    "--stats-db",
+    type=click.Path(),
+    help="SQLite file to keep the task statistics across restarts.",
+)
+@click.option(
+    "--stats-retention",
+    default=7,
+    help="Days to keep the task statistics in --stats-db.",
+    show_default=True,
+)
+@click.option(
+    "--metrics-port",
+    default=0,
+    help="Serve Prometheus metrics on http://<metrics-host>:<port>/metrics. 0: disable.",
+    show_default=True,
+)
+@click.option(
+    "--metrics-host",
+    default="127.0.0.1",
+    help="Listen address of the metrics endpoint.",
+    show_default=True,
+)
+@click.option(
+    "--profile-log",
+    type=click.Path(),
+    help="Append timing of RPC calls, cycle phases and per-cycle summaries "
+    "to this file as JSON lines.",
+)
+@click.option(
+    "--batch",
+    is_flag=True,
+    help="Swap tasks in batch by system.multicall, instead of one by one.",
+)
+@click.option(
+    "--asyncio",
+    "use_asyncio",
+    is_flag=True,
+    help="Swap tasks concurrently with asyncio, instead of one by one. Ignored with --batch.",
+)
+@click.option(
+    "--swap-timeout",
+    default=60,
+    help="Timeout of swapping a task, seconds. Only for --asyncio.",
+    show_default=True,
+)
+@click.option(
+    "--watch",
+    is_flag=True,
+    help="Wake up on aria2 WebSocket notifications, --interval is used as the stall timer. "
+    "Fall back to polling if the WebSocket is not connected.",
+)
+@click.option(
+    "--rebalance",
+    is_flag=True,
+    help="With several endpoints in the config, move waiting tasks not started yet "
+    "from a saturated aria2 to an idle one.",
+)
+@click.option(
+    "--rebalance-interval",
+    default=60,
+    help="Seconds between the rebalance rounds.",
+    show_default=True,
+)
 @click.option("-v", "--verbose", count=True, help="Increase output verbosity.")
-def run(config_file, host, port, token, interval, verbose):
+def run(
+    config_file,
+    host,
+    port,
+    token,
+    transport,
+    rpc_timeout,
+    rpc_retries,
+    interval,
+    stall_window,
+    stall_speed,
+    strategy,
+    probe_size,
+    probe_window,
+    stats_db,
+    stats_retention,
+    metrics_port,
+    metrics_host,
+    profile_log,
+    batch,
+    use_asyncio,
+    swap_timeout,
+    watch,
+    rebalance,
+    rebalance_interval,
+    verbose,
+):
     max_level = max(LOG_LEVELS, key=int)
     logging.basicConfig(
         level=LOG_LEVELS.get(min(verbose, max_level), logging.INFO), format=LOG_FORMAT
@@ -66,28 +220,161 @@ def run(config_file, host, port, token, interval, verbose):
         logging.getLogger("urllib3.connectionpool").setLevel(logging.WARNING)
 
     config = load_aria2_config(config_file)
+    if host or port or token:  # one endpoint, from the command line
+        config = {k: v for k, v in config.items() if k != "endpoints"}
+    try:
+        endpoints = aria2_endpoints(config)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    fleet = len(endpoints) > 1
+    if fleet:  # tell the endpoints apart
+        for handler in logging.getLogger().handlers:
+            handler.setFormatter(logging.Formatter(FLEET_LOG_FORMAT))
+
+    register_single()
 
-    aria2 = aria2p.API(
-        aria2p.Client(
-            host=host or config.get("host"),
-            port=port or config.get("port"),
-            secret=token or config.get("token"),
+    metrics = None
+    if metrics_port:
+        metrics = Metrics(prefix="aria2rpc_oversee")
+        metrics.serve(metrics_port, host=metrics_host)
+    profile_hook = JsonLogHook(profile_log) if profile_log else None
+    stores = []
+    overseers = {}  # name -> (aria2, manager, watcher)
+    for endpoint in endpoints:
+        name = endpoint["name"]
+        aria2 = aria2p.API(
+            create_client(
+                endpoint,
+                host,
+                port,
+                token,
+                transport=transport,
+                timeout=rpc_timeout,
+                retries=rpc_retries,
+                # a connection per concurrent swap
+                pool_size=ASYNC_MAX_WORKERS if use_asyncio else None,
+            )
         )
-    )
+        store = None
+        if stats_db:
+            store = SampleStore(
+                endpoint_filename(stats_db, name) if fleet else stats_db,
+                retention=stats_retention * 86400,
+            )
+            stores.append(store)
+        instrumentation = Instrumentation()
+        if profile_hook:
+            instrumentation.add_hook(
+                partial(endpoint_event, profile_hook, name) if fleet else profile_hook
+            )
+        options = {
+            "batch": batch,
+            # event driven run may come at any time, sample the tasks at most once per interval
+            "sample_interval": interval if watch else 0,
+            "stall_window": stall_window,
+            "stall_speed": stall_speed,
+            "strategy": strategy,
+            "probe_size": probe_size,
+            "probe_window": probe_window,
+            "store": store,
+            "metrics": metrics.labeled(endpoint=name) if metrics and fleet else metrics,
+            "instrumentation": instrumentation,
+        }
+        if use_asyncio:
+            aria2_queue_manager = AsyncAria2QueueManager(
+                aria2, exit_event, timeout=swap_timeout, **options
+            )
+        else:
+            aria2_queue_manager = Aria2QueueManager(aria2, exit_event, **options)
+        watcher = Aria2EventWatcher(aria2.client) if watch else None
+        overseers[name] = (aria2, aria2_queue_manager, watcher)
 
-    register_single()
+    if not fleet:
+        _, aria2_queue_manager, watcher = overseers[endpoints[0]["name"]]
+        oversee(aria2_queue_manager, watcher, interval)
+    else:
+        logger.info(f"Oversee {len(overseers)} endpoints: {', '.join(overseers)}")
+        threads = [
+            threading.Thread(
+                target=oversee_isolated,
+                args=(name, manager, watcher, interval),
+                name=f"oversee-{name}",
+            )
+            for name, (_, manager, watcher) in overseers.items()
+        ]
+        if rebalance:
+            rebalancer = Rebalancer({name: o[0] for name, o in overseers.items()})
+            threads.append(
+                threading.Thread(
+                    target=rebalance_loop,
+                    args=(rebalancer, rebalance_interval),
+                    name="rebalance",
+                )
+            )
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(EXIT_CHECK_INTERVAL)
+    for store in stores:
+        store.close()
+    if metrics:
+        metrics.shutdown()
+    if profile_hook:
+        profile_hook.close()
+    click.secho("Program exit.", fg="green")
 
-    aria2_queue_manager = Aria2QueueManager(aria2, exit_event)
 
+def oversee(aria2_queue_manager, watcher, interval):
+    """run the queue manager of an endpoint until the program exits"""
+    logger = logging.getLogger(__name__)
     logger.debug("Main loop.")
     while not exit_event.is_set():
         try:
             aria2_queue_manager.run()
         except requests.exceptions.ConnectTimeout as e:
             logger.warning("Connect Timeout: %s", str(e))
-        logger.info(f"sleep {interval}s.")
-        exit_event.wait(interval)
-    click.secho("Program exit.", fg="green")
+        if watcher:
+            watcher.sync(aria2_queue_manager.queue)
+            watcher.wait(exit_event, interval)
+        else:
+            logger.info(f"sleep {interval}s.")
+            exit_event.wait(interval)
+    if watcher:
+        watcher.stop()
+
+
+def oversee_isolated(name, aria2_queue_manager, watcher, interval):
+    """`oversee` in a fleet, an endpoint failing is retried, the others keep going"""
+    logger = logging.getLogger(__name__)
+    delay = FAILURE_RETRY_DELAY
+    while not exit_event.is_set():
+        start = time.monotonic()
+        try:
+            oversee(aria2_queue_manager, watcher, interval)
+        except Exception as e:
+            if time.monotonic() - start > interval:  # was fine for a while
+                delay = FAILURE_RETRY_DELAY
+            logger.warning(f"[{name}] failed: {e!r}, retry in {delay}s.")
+            logger.debug(f"[{name}] failed", exc_info=True)
+            exit_event.wait(delay)
+            delay = min(delay * 2, interval)
+
+
+def rebalance_loop(rebalancer, interval):
+    logger = logging.getLogger(__name__)
+    while not exit_event.wait(interval):
+        try:
+            moved = rebalancer.run()
+        except Exception as e:
+            logger.warning(f"Rebalance failed: {e!r}")
+            continue
+        if moved:
+            logger.info(f"Rebalance: moved {moved} tasks.")
+
+
+def endpoint_event(hook, name, event):
+    hook({**event, "endpoint": name})
 
 
 if __name__ == "__main__":
@@ -1,9 +1,18 @@
-import aria2p
 import json
 import logging
+import time
 
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from aria2rpc.lazy import lazy_import
+from aria2rpc.instrument import Instrumentation, MetricsHook
+from aria2rpc.stats import TaskStatistics
+from aria2rpc.strategy import get_strategy, DEFAULT_STRATEGY
+
+
+aria2p = lazy_import("aria2p")
+asyncio = lazy_import("asyncio")
 
 DEFAULT_CONFIG_PATH = ".aria2"
 DEFAULT_ARIA2_CONFIG = "aria2rpc.json"
@@ -11,6 +20,26 @@ DEFAULT_TORRENT_EXCLUDE_LIST_FILE = ".cleanup-patterns.yml"
 DEFAULT_ARIA2_HOST = "http://localhost"
 DEFAULT_ARIA2_PORT = 6800
 DEFAULT_ARIA2_JSONRPC = f"{DEFAULT_ARIA2_HOST}:{DEFAULT_ARIA2_PORT}/jsonrpc"
+DEFAULT_HOOK_SOCKET = "/tmp/aria2-hook.sock"
+DEFAULT_MOVE_QUEUE = f"~/{DEFAULT_CONFIG_PATH}/move-queue.json"
+# keys requested by the queue polling, see `aria2.tellStatus` for the full list.
+# aria2 has no "name" key, the name is taken from the "bittorrent" info (if any).
+QUEUE_KEYS = [
+    "gid",
+    "status",
+    "totalLength",
+    "completedLength",
+    "downloadSpeed",
+    "uploadSpeed",
+    "connections",
+    "numSeeders",
+    "bittorrent",
+]
+WAITING_PAGE_SIZE = 1000
+STOPPED_STATUS = ("complete", "error", "removed")
+EXIT_CHECK_INTERVAL = 0.5
+TRANSPORTS = ("http", "websocket")
+ASYNC_MAX_WORKERS = 16
 LOG_LEVELS = {
     0: logging.WARNING,
     1: logging.INFO,
@@ -78,6 +107,50 @@ def load_aria2_config(config_file, guess_paths=None):
     return {**default_config, **config}
 
 
+def aria2_endpoints(config):
+    """
+    The aria2 instances of the config,
+    {"endpoints": [{"name": "disk1", "host": ..., "port": ..., "token": ...}, ...]},
+    the other keys of the config are the defaults of each endpoint
+    :return: [dict], the config itself if it has no "endpoints", each with a "name"
+    """
+    defaults = {k: v for k, v in config.items() if k != "endpoints"}
+    endpoints = []
+    for endpoint in config.get("endpoints") or [{}]:
+        endpoint = {**defaults, **endpoint}
+        endpoint.setdefault("name", f"{endpoint.get('host')}:{endpoint.get('port')}")
+        endpoints.append(endpoint)
+    names = [endpoint["name"] for endpoint in endpoints]
+    if len(set(names)) != len(names):
+        raise ValueError(f"duplicate endpoint names: {names}")
+    return endpoints
+
+
+def multicall(client, calls):
+    """
+    Call methods in one `system.multicall` request
+    :param client: aria2p.Client
+    :param calls: [(method, params)]
+    :return: [result or aria2p.client.ClientException]
+    """
+    if not calls:
+        return []
+    return [
+        result[0]
+        if isinstance(result, list)
+        else aria2p.client.ClientException(result["code"], result["message"])
+        for result in client.multicall2(calls)
+    ]
+
+
+def task_name(task):
+    """name of the task, tolerate the task struct fetched without "files" key"""
+    try:
+        return task.name
+    except (IndexError, KeyError):
+        return ""
+
+
 def task_briefing(task):
     return (
         f"{task.gid:<17} "
@@ -86,23 +159,121 @@ def task_briefing(task):
         f"{task.download_speed_string():>12} "
         f"{task.upload_speed_string():>12} "
         f"{task.eta_string():>8}  "
-        f"{task.name}"
+        f"{task_name(task)}"
     )
 
 
 class Aria2QueueManager:
     """Queue Manager"""
 
-    def __init__(self, aria2rpc, exit_event):
+    def __init__(
+        self,
+        aria2rpc,
+        exit_event,
+        batch=False,
+        sample_interval=0,
+        stall_window=3,
+        stall_speed=0,
+        strategy=DEFAULT_STRATEGY,
+        probe_size=0,
+        probe_window=30,
+        store=None,
+        metrics=None,
+        instrumentation=None,
+    ):
+        """
+        :param stall_window: int, samples of speed history, a task is stalled
+            if its average speed over the whole window is not above `stall_speed`
+        :param stall_speed: int, bytes/s
+        :param strategy: str, name of swap strategy, see aria2rpc.strategy.STRATEGIES
+        :param probe_size: int, waiting tasks to probe per cycle, 0: disable probing
+        :param probe_window: int, seconds to measure the speed of probed tasks
+        :param store: aria2rpc.store.SampleStore, persist the statistics across restarts
+        :param metrics: aria2rpc.metrics.Metrics, export the data of each cycle
+        :param instrumentation: aria2rpc.instrument.Instrumentation, timing hooks
+        """
         self.queue = []
-        self.statistics = {}
+        self.batch = batch
+        self.sample_interval = sample_interval
+        self.statistics = TaskStatistics(window=stall_window, store=store)
+        self.stall_speed = stall_speed
+        self.strategy = get_strategy(strategy, self.statistics, stall_speed)
+        self.probe_size = probe_size
+        self.probe_window = probe_window
         self.aria2rpc = aria2rpc
         self.exit_event = exit_event
+        self.metrics = metrics
+        self.instrumentation = instrumentation or Instrumentation()
+        if metrics:
+            self.instrumentation.add_hook(MetricsHook(metrics))
+        self.instrumentation.instrument_client(aria2rpc.client)
         self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
 
+    def wait(self, delay):
+        """wait for a status change, return True if the program is exiting"""
+        start = time.monotonic()
+        try:
+            return self.exit_event.wait(delay)
+        finally:
+            self.instrumentation.wait(time.monotonic() - start)
+
+    def report_queue(self, task_active, task_waiting):
+        if not self.metrics:
+            return
+        metrics = self.metrics
+        metrics.set("tasks", len(task_active), "Tasks in queue", status="active")
+        metrics.set("tasks", len(task_waiting), "Tasks in queue", status="waiting")
+        metrics.set(
+            "download_speed_bytes",
+            sum(task.download_speed for task in task_active),
+            "Global download speed",
+        )
+        metrics.set(
+            "upload_speed_bytes",
+            sum(task.upload_speed for task in task_active),
+            "Global upload speed",
+        )
+        # per-task gauges of active tasks only, tasks gone are dropped
+        for name in ("task_download_speed_bytes", "task_completed_length_bytes"):
+            metrics.clear(name)
+        for task in task_active:
+            metrics.set(
+                "task_download_speed_bytes",
+                task.download_speed,
+                "Download speed of active tasks",
+                gid=task.gid,
+                name=task_name(task),
+            )
+            metrics.set(
+                "task_completed_length_bytes",
+                task.completed_length,
+                "Completed length of active tasks",
+                gid=task.gid,
+                name=task_name(task),
+            )
+
+    def fetch_tasks(self, keys=None):
+        """
+        Fetch active and waiting tasks with only the given keys, skip stopped tasks
+        :param keys: [str] keys of task struct, default: QUEUE_KEYS
+        :return: [aria2p.downloads.Download]
+        """
+        client = self.aria2rpc.client
+        keys = keys or QUEUE_KEYS
+        structs = client.tell_active(keys)
+        offset = 0
+        while True:
+            page = client.tell_waiting(offset, WAITING_PAGE_SIZE, keys)
+            structs.extend(page)
+            if len(page) < WAITING_PAGE_SIZE:
+                break
+            offset += len(page)
+        return [aria2p.Download(self.aria2rpc, struct) for struct in structs]
+
     def get_data(self):
         self.logger.debug(f"Fetch tasks from RPC")
-        tasks = self.aria2rpc.get_downloads()
+        tasks = self.fetch_tasks()
+        self.queue = tasks
         task_active = []
         task_waiting = []
         for task in tasks:
@@ -110,12 +281,11 @@ class Aria2QueueManager:
                 task_active.append(task)
             elif task.is_waiting:
                 task_waiting.append(task)
-            elif task.is_complete:
-                continue
             self.logger.info(task_briefing(task))
         self.logger.info(
             f"Task Active: {len(task_active)}, Waiting: {len(task_waiting)}"
         )
+        self.report_queue(task_active, task_waiting)
         return task_active, task_waiting
 
     def change_task_status(self, task, status, condition, hint=None):
@@ -139,63 +309,428 @@ class Aria2QueueManager:
             self.logger.debug(
                 f">>> task( {task.gid} ).status={task.status}, wait {delay}s for status {hint}"
             )
-            self.exit_event.wait(delay)
+            self.wait(delay)
         else:
             return False
 
-    def update(self, task_list, task_max_count):
+    def wait_tasks_status(self, gids, condition, hint=None, timeout=None):
+        """
+        Wait for the status of tasks changed, check all tasks by one `system.multicall`
+        :param gids: [str]
+        :param condition: callable(status) -> bool
+        :param hint: str
+        :param timeout: int, seconds, wait until the program exits if None
+        :return: [str] gids which meet the condition
+        """
+        pending = list(gids)
+        done = []
+        n = 0
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while pending and not self.exit_event.is_set():
+            results = multicall(
+                self.aria2rpc.client,
+                [
+                    (aria2p.Client.TELL_STATUS, [gid, ["gid", "status"]])
+                    for gid in pending
+                ],
+            )
+            waiting = []
+            for gid, result in zip(pending, results):
+                if isinstance(result, aria2p.client.ClientException):
+                    self.logger.error(f"task( {gid} ) ClientException: {result}")
+                elif condition(result["status"]):
+                    done.append(gid)
+                elif result["status"] in STOPPED_STATUS:
+                    self.logger.warning(
+                        f"task( {gid} ).status={result['status']}, give up waiting for status {hint}"
+                    )
+                else:
+                    waiting.append(gid)
+            pending = waiting
+            if not pending:
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                self.logger.warning(
+                    f">>> {len(pending)} tasks, timeout for status {hint}"
+                )
+                break
+            delay = min(2**n, 10)
+            n += 1
+            self.logger.debug(
+                f">>> {len(pending)} tasks, wait {delay}s for status {hint}"
+            )
+            self.wait(delay)
+        return done
+
+    def swap_tasks(self, tasks):
+        """
+        Swap out tasks one by one: pause, move to bottom, resume
+        :param tasks: [aria2p.downloads.Download]
+        :return: int, count of swapped tasks
+        """
+        swap_count = 0
+        for task in tasks:
+            if not self.change_task_status(
+                task, "pause", condition=lambda d: d.live.is_paused, hint="paused"
+            ):
+                self.logger.warning(
+                    f"Program is exiting. "
+                    f"And the task( {task.gid} ) is switching to the pause status, "
+                    f"which may cause the status of the task to not resume normally"
+                )
+                break
+            self.logger.debug(f"task( {task.gid} ) move to bottom")
+            task.move_to_bottom()
+            # self.exit_event.wait(1)
+            if not self.change_task_status(
+                task,
+                "resume",
+                condition=lambda d: not d.live.is_paused,
+                hint="not paused",
+            ):
+                break
+            swap_count += 1
+        return swap_count
+
+    def swap_tasks_batch(self, tasks):
+        """
+        Swap out tasks in batch: forcePause all, then move to bottom and unpause the paused ones,
+        each step is one `system.multicall`
+        :param tasks: [aria2p.downloads.Download]
+        :return: int, count of swapped tasks
         """
-        Strategy of task swap: download size
-        :param task_list: [aria2p.downloads.Download]
+        if not tasks or self.exit_event.is_set():
+            return 0
+        client = self.aria2rpc.client
+        gids = [task.gid for task in tasks]
+        self.logger.debug(f">>> forcePause {len(gids)} tasks")
+        for gid, result in zip(
+            gids, multicall(client, [(client.FORCE_PAUSE, [gid]) for gid in gids])
+        ):
+            if isinstance(result, aria2p.client.ClientException):
+                self.logger.error(f"task( {gid} ) ClientException: {result}")
+        # a task can be moved/unpaused only when it is in the waiting queue (paused)
+        paused = self.wait_tasks_status(
+            gids, condition=lambda status: status == "paused", hint="paused"
+        )
+        if self.exit_event.is_set():
+            self.logger.warning(
+                f"Program is exiting. "
+                f"And {len(gids) - len(paused)} tasks are switching to the pause status, "
+                f"which may cause the status of the tasks to not resume normally"
+            )
+            if not paused:
+                return 0
+        self.logger.debug(f">>> move to bottom and unpause {len(paused)} tasks")
+        calls = [(client.CHANGE_POSITION, [gid, 0, "POS_END"]) for gid in paused]
+        calls += [(client.UNPAUSE, [gid]) for gid in paused]
+        results = multicall(client, calls)
+        for (method, params), result in zip(calls, results):
+            if isinstance(result, aria2p.client.ClientException):
+                self.logger.error(
+                    f"task( {params[0]} ) {method} ClientException: {result}"
+                )
+        resumed = self.wait_tasks_status(
+            paused, condition=lambda status: status != "paused", hint="not paused"
+        )
+        return len(resumed)
+
+    def promote_tasks(self, tasks):
+        """
+        Move tasks to the top of the waiting queue in order, aria2 starts them next
+        :param tasks: [aria2p.downloads.Download]
+        """
+        if not tasks:
+            return
+        client = self.aria2rpc.client
+        self.logger.debug(f">>> move {len(tasks)} tasks to top")
+        calls = [
+            (client.CHANGE_POSITION, [task.gid, pos, "POS_SET"])
+            for pos, task in enumerate(tasks)
+        ]
+        for task, result in zip(tasks, multicall(client, calls)):
+            if isinstance(result, aria2p.client.ClientException):
+                self.logger.error(f"task( {task.gid} ) ClientException: {result}")
+            else:
+                self.logger.info(f'promote task {task.gid} "{task_name(task)}"')
+
+    def update(self, task_list, task_max_count, task_waiting=None):
+        """
+        Strategy of task swap: see aria2rpc.strategy
+        :param task_list: [aria2p.downloads.Download], active tasks
         :param task_max_count: int
+        :param task_waiting: [aria2p.downloads.Download], waiting tasks
         :return:
         """
         task: aria2p.downloads.Download
-        swap_count = 0
-        for idx, task in enumerate(task_list, start=1):
-            gid = task.gid
-            completed_length = task.completed_length
-            s = self.statistics.setdefault(gid, {"completed-length": 0, "increment": 0})
-            prev_length = s.get("completed-length", 0)
-            increment = completed_length - prev_length
-            s["completed-length"] = completed_length
-            s["increment"] = increment
-            # self.logger.debug(f'* {gid}: {increment}')
-            if not increment:
-                swap_count += 1
-                self.logger.info(
-                    f'{idx}: swap out ({swap_count}/{task_max_count}) task {task.gid} "{task.name}"'
+        instrumentation = self.instrumentation
+        sampled = []
+        now = time.time()
+        with instrumentation.phase("sample"):
+            # tasks left the active queue are evicted, their history is stale
+            self.statistics.retain(
+                [task.gid for task in task_list],
+                known=[task.gid for task in self.queue] if self.queue else None,
+            )
+            for task in task_list:
+                gid = task.gid
+                samples = self.statistics.get(gid)
+                # too early to tell whether the task is stalled
+                if samples and now - samples[-1][0] < self.sample_interval:
+                    continue
+                self.statistics.add(
+                    gid,
+                    now,
+                    task.completed_length,
+                    download_speed=task.download_speed,
+                    upload_speed=task.upload_speed,
+                    connections=task.connections,
                 )
-
-                if not self.change_task_status(
-                    task, "pause", condition=lambda d: d.live.is_paused, hint="paused"
-                ):
-                    self.logger.warning(
-                        f"Program is exiting. "
-                        f"And the task( {task.gid} ) is switching to the pause status, "
-                        f"which may cause the status of the task to not resume normally"
-                    )
-                    break
-                self.logger.debug(f"task( {task.gid} ) move to bottom")
-                task.move_to_bottom()
-                # self.exit_event.wait(1)
-                if not self.change_task_status(
-                    task,
-                    "resume",
-                    condition=lambda d: not d.live.is_paused,
-                    hint="not paused",
-                ):
-                    break
-                if swap_count >= task_max_count:
-                    break
-        if swap_count:
+                # self.logger.debug(f'* {gid}: {self.statistics.rate(gid)}')
+                sampled.append(task)
+        with instrumentation.phase("select"):
+            swap_out = self.strategy.swap_out(sampled, task_max_count)
+            promote = (
+                self.strategy.promote(task_waiting, len(swap_out))
+                if swap_out and task_waiting
+                else []
+            )
+        for idx, task in enumerate(swap_out, start=1):
+            self.logger.info(
+                f'{idx}: swap out ({idx}/{task_max_count}) task {task.gid} "{task_name(task)}"'
+            )
+        with instrumentation.phase("promote"):
+            # move to top before the swap, aria2 starts the top waiting task once a slot is free
+            self.promote_tasks(promote)
+        with instrumentation.phase("swap"):
+            if self.batch:
+                swap_count = self.swap_tasks_batch(swap_out)
+            else:
+                swap_count = self.swap_tasks(swap_out)
+        if self.metrics:
+            self.metrics.inc("swapped_tasks_total", swap_count, "Tasks swapped out")
+        if swap_out:
             self.logger.info(f"Swap {swap_count} tasks. Good luck!")
         else:
             self.logger.info("No need to swap, all tasks are downloading ^_^")
 
-    def run(self):
-        task_active, task_waiting = self.get_data()
-        if task_waiting:
-            self.update(task_active, min(len(task_active), len(task_waiting)))
+    def tell_completed_length(self, gids):
+        """
+        :param gids: [str]
+        :return: {gid: (timestamp, completed_length)}
+        """
+        client = self.aria2rpc.client
+        results = multicall(
+            client,
+            [(client.TELL_STATUS, [gid, ["gid", "completedLength"]]) for gid in gids],
+        )
+        now = time.monotonic()
+        return {
+            gid: (now, int(result["completedLength"]))
+            for gid, result in zip(gids, results)
+            if not isinstance(result, aria2p.client.ClientException)
+        }
+
+    def probe(self, task_waiting):
+        """
+        Probe waiting tasks never measured: raise max-concurrent-downloads and move them
+        to the top for a short window, record their speed, then swap out the slowest
+        tasks to restore the concurrency
+        :param task_waiting: [aria2p.downloads.Download]
+        """
+        probes = [
+            task for task in task_waiting if self.statistics.speed(task.gid) is None
+        ][: self.probe_size]
+        if not probes or self.exit_event.is_set():
+            return
+        client = self.aria2rpc.client
+        gids = [task.gid for task in probes]
+        max_concurrent = int(client.get_global_option()["max-concurrent-downloads"])
+        self.logger.info(f"Probe {len(probes)} waiting tasks for {self.probe_window}s")
+        self.promote_tasks(probes)
+        try:
+            client.change_global_option(
+                {"max-concurrent-downloads": str(max_concurrent + len(probes))}
+            )
+            started = self.wait_tasks_status(
+                gids,
+                condition=lambda status: status == "active",
+                hint="active",
+                timeout=self.probe_window,
+            )
+            before = self.tell_completed_length(started)
+            self.wait(self.probe_window)
+            after = self.tell_completed_length(started)
+        finally:
+            # aria2 does not stop the extra active tasks, they are swapped out below
+            client.change_global_option(
+                {"max-concurrent-downloads": str(max_concurrent)}
+            )
+        for gid in gids:
+            # not started in the window, left unmeasured to be probed again later
+            if gid not in before or gid not in after:
+                self.logger.info(f"probe task {gid}: not started")
+                continue
+            speed = 0
+            if after[gid][0] > before[gid][0]:
+                speed = (after[gid][1] - before[gid][1]) / (
+                    after[gid][0] - before[gid][0]
+                )
+            self.statistics.record(gid, speed)
+            self.logger.info(f"probe task {gid}: {speed:.0f} B/s")
+        # keep the fastest tasks active
+        task_active = [
+            aria2p.Download(self.aria2rpc, struct)
+            for struct in client.tell_active(QUEUE_KEYS)
+        ]
+
+        def speed_of(task):
+            speed = self.statistics.speed(task.gid)
+            speed = task.download_speed if speed is None else speed
+            return speed, task.gid not in gids  # same speed: prefer incumbent tasks
+
+        task_active.sort(key=speed_of, reverse=True)
+        swap_out = task_active[max_concurrent:]
+        for task in swap_out:
+            self.logger.info(f'probe: swap out task {task.gid} "{task_name(task)}"')
+        if self.batch:
+            self.swap_tasks_batch(swap_out)
         else:
-            self.logger.info("No waiting tasks")
+            self.swap_tasks(swap_out)
+
+    def run(self):
+        instrumentation = self.instrumentation
+        instrumentation.start_cycle()
+        try:
+            with instrumentation.phase("get_data"):
+                task_active, task_waiting = self.get_data()
+            if task_waiting:
+                with instrumentation.phase("update"):
+                    self.update(
+                        task_active,
+                        min(len(task_active), len(task_waiting)),
+                        task_waiting,
+                    )
+                if self.probe_size:
+                    with instrumentation.phase("probe"):
+                        self.probe(task_waiting)
+            else:
+                self.logger.info("No waiting tasks")
+        finally:
+            if self.statistics.store:
+                with instrumentation.phase("flush"):
+                    self.statistics.store.flush()
+            summary = instrumentation.end_cycle()
+            self.logger.debug(
+                f"cycle {summary['duration']:.3f}s, "
+                f"{summary['calls']} calls, {summary['bytes_received']} bytes received, "
+                f"wait {summary['wait_time']:.3f}s"
+            )
+
+
+class AsyncAria2QueueManager(Aria2QueueManager):
+    """Queue Manager, swap tasks concurrently with asyncio"""
+
+    def __init__(
+        self, aria2rpc, exit_event, timeout=60, max_workers=ASYNC_MAX_WORKERS, **kwargs
+    ):
+        """
+        :param timeout: int, seconds to wait for a task swapped
+        :param max_workers: int, max concurrent RPC calls
+        """
+        super().__init__(aria2rpc, exit_event, **kwargs)
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="aria2rpc"
+        )
+
+    async def call(self, func, *args):
+        """run a blocking RPC call in the thread pool"""
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, func, *args
+        )
+
+    async def sleep(self, delay):
+        """sleep `delay` seconds, return False once the program is exiting"""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        deadline = start + delay
+        try:
+            while not self.exit_event.is_set():
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return True
+                await asyncio.sleep(min(remaining, EXIT_CHECK_INTERVAL))
+            return False
+        finally:
+            self.instrumentation.wait(loop.time() - start)
+
+    async def change_task_status_async(self, task, status, condition, hint=None):
+        if self.exit_event.is_set():
+            return False
+        self.logger.debug(f">>> task( {task.gid} ).{status}()")
+        try:
+            await self.call(getattr(task, status))  # call status()
+        except aria2p.client.ClientException as e:
+            self.logger.error("ClientException: " + str(e))
+        # wait status changed
+        n = 0
+        while True:
+            if await self.call(condition, task):
+                self.logger.debug(
+                    f">>> task( {task.gid} ).status={task.status}, meet the condition <{hint}>"
+                )
+                return True
+            delay = min(2**n, 10)
+            n += 1
+            self.logger.debug(
+                f">>> task( {task.gid} ).status={task.status}, wait {delay}s for status {hint}"
+            )
+            if not await self.sleep(delay):
+                return False
+
+    async def swap_task(self, task):
+        if not await self.change_task_status_async(
+            task, "pause", condition=lambda d: d.live.is_paused, hint="paused"
+        ):
+            self.logger.warning(
+                f"Program is exiting. "
+                f"And the task( {task.gid} ) is switching to the pause status, "
+                f"which may cause the status of the task to not resume normally"
+            )
+            return False
+        self.logger.debug(f"task( {task.gid} ) move to bottom")
+        await self.call(task.move_to_bottom)
+        return await self.change_task_status_async(
+            task, "resume", condition=lambda d: not d.live.is_paused, hint="not paused"
+        )
+
+    async def swap_task_with_timeout(self, task):
+        try:
+            return await asyncio.wait_for(self.swap_task(task), self.timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning(
+                f"task( {task.gid} ) is not swapped in {self.timeout}s, give up"
+            )
+            # cancelled between pause and resume, a paused task is never swapped again
+            try:
+                await self.call(self.aria2rpc.client.unpause, task.gid)
+            except aria2p.client.ClientException as e:  # not paused
+                self.logger.debug(f"task( {task.gid} ) unpause: {e}")
+            return False
+
+    async def swap_tasks_async(self, tasks):
+        results = await asyncio.gather(
+            *(self.swap_task_with_timeout(task) for task in tasks)
+        )
+        return sum(results)
+
+    def swap_tasks(self, tasks):
+        """
+        Swap out tasks concurrently, the cycle time is bounded by the slowest task
+        :param tasks: [aria2p.downloads.Download]
+        :return: int, count of swapped tasks
+        """
+        if not tasks:
+            return 0
+        return asyncio.run(self.swap_tasks_async(tasks))
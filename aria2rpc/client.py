@@ -0,0 +1,141 @@
+import json
+import logging
+import threading
+
+import aria2p
+import requests
+import websocket
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from aria2rpc import TRANSPORTS
+
+
+DEFAULT_TIMEOUT = 60.0
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_RETRIES = 2
+DEFAULT_POOL_SIZE = 8
+logger = logging.getLogger(__name__)
+
+
+class PooledClient(aria2p.Client):
+    """
+    aria2p.Client sending the requests over a persistent connection:
+    - http: a pooled keep-alive `requests.Session`, connect errors are retried
+    - websocket: one WebSocket connection, reconnected on failure
+    """
+
+    def __init__(
+        self,
+        host=aria2p.client.DEFAULT_HOST,
+        port=aria2p.client.DEFAULT_PORT,
+        secret="",
+        timeout=DEFAULT_TIMEOUT,
+        connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+        retries=DEFAULT_RETRIES,
+        pool_size=DEFAULT_POOL_SIZE,
+        transport="http",
+    ):
+        """
+        :param timeout: float, seconds to wait for a response
+        :param connect_timeout: float, seconds to wait for a connection
+        :param retries: int, retries of failed connections, a sent request is never retried
+        :param pool_size: int, max connections kept alive, e.g. for concurrent swaps
+        :param transport: str, http or websocket
+        """
+        super().__init__(host=host, port=port, secret=secret, timeout=timeout)
+        if transport not in TRANSPORTS:
+            raise ValueError(f"unknown transport: {transport}")
+        self.connect_timeout = connect_timeout
+        self.retries = retries
+        self.transport = transport
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            max_retries=Retry(
+                total=retries, connect=retries, read=0, status=0, backoff_factor=0.2
+            ),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._ws = None
+        self._ws_lock = threading.Lock()
+
+    def send(self, payload):
+        """
+        :param payload: str, JSON-RPC request
+        :return: bytes, JSON-RPC response
+        """
+        if self.transport == "websocket":
+            return self._send_ws(payload)
+        response = self.session.post(
+            self.server, data=payload, timeout=(self.connect_timeout, self.timeout)
+        )
+        return response.content
+
+    def post(self, payload):
+        return json.loads(self.send(payload))
+
+    def _send_ws(self, payload):
+        request_id = json.loads(payload).get("id")
+        with self._ws_lock:
+            for attempt in range(self.retries + 1):
+                try:
+                    if self._ws is None:
+                        self._ws = websocket.create_connection(
+                            self.ws_server, timeout=self.connect_timeout
+                        )
+                        self._ws.settimeout(self.timeout)
+                    self._ws.send(payload)
+                    break
+                except (OSError, websocket.WebSocketException) as e:
+                    self._close_ws()
+                    if attempt == self.retries:
+                        raise requests.exceptions.ConnectionError(str(e)) from e
+                    logger.debug(f"reconnect {self.ws_server}: {e!r}")
+            try:
+                while True:
+                    message = self._ws.recv()
+                    # skip the notifications, they have no id
+                    if json.loads(message).get("id", None) == request_id:
+                        return message.encode() if isinstance(message, str) else message
+            except (OSError, websocket.WebSocketException) as e:
+                self._close_ws()
+                raise requests.exceptions.ConnectionError(str(e)) from e
+
+    def _close_ws(self):
+        if self._ws is not None:
+            try:
+                self._ws.close()
+            except (OSError, websocket.WebSocketException):
+                pass
+            self._ws = None
+
+    def close(self):
+        with self._ws_lock:
+            self._close_ws()
+        self.session.close()
+
+
+def create_client(config, host=None, port=None, token=None, **options):
+    """
+    The client shared by the entry points, command line arguments override the config
+    :param config: dict, see `load_aria2_config`, may set
+        "timeout", "connect_timeout", "retries", "pool_size" and "transport"
+    :param options: overrides of the config, None values are ignored
+    :return: PooledClient
+    """
+    settings = {
+        key: config[key]
+        for key in ("timeout", "connect_timeout", "retries", "pool_size", "transport")
+        if key in config
+    }
+    settings.update({k: v for k, v in options.items() if v is not None})
+    return PooledClient(
+        host=host or config.get("host"),
+        port=port or config.get("port"),
+        secret=token or config.get("token"),
+        **settings,
+    )
@@ -0,0 +1,172 @@
+import struct
+import sys
+
+from pathlib import Path
+
+
+# @see https://aria2.github.io/manual/en/html/technical-notes.html#control-file-aria2-format
+BLOCK_LENGTH = 16 * 1024
+CONTROL_FILE_SUFFIX = ".aria2"
+
+
+class ControlFileError(ValueError):
+    pass
+
+
+class ControlFile:
+    """Download progress saved by aria2 in "<file>.aria2", see `ControlFile.parse`"""
+
+    def __init__(
+        self,
+        version,
+        info_hash,
+        piece_length,
+        total_length,
+        upload_length=0,
+        bitfield=b"",
+        in_flight=(),
+    ):
+        """
+        :param info_hash: str, hex, None if not a BitTorrent download
+        :param bitfield: bytes, bit of each piece, the most significant bit first
+        :param in_flight: [(piece index, piece length, block bitfield)], pieces in progress
+        """
+        self.version = version
+        self.info_hash = info_hash
+        self.piece_length = piece_length
+        self.total_length = total_length
+        self.upload_length = upload_length
+        self.bitfield = bitfield
+        self.in_flight = list(in_flight)
+
+    @classmethod
+    def parse(cls, data):
+        """
+        :param data: bytes, content of the control file
+        :return: ControlFile
+        """
+        if len(data) < 2:
+            raise ControlFileError("truncated control file")
+        version = int.from_bytes(data[:2], "big")
+        if version == 1:
+            order = ">"  # network byte order
+        elif version == 0:
+            order = "<" if sys.byteorder == "little" else ">"  # host byte order
+        else:
+            raise ControlFileError(f"unsupported control file version: {version}")
+        pos = 2
+
+        def read(fmt):
+            nonlocal pos
+            size = struct.calcsize(order + fmt)
+            if pos + size > len(data):
+                raise ControlFileError(f"truncated control file at pos {pos}")
+            values = struct.unpack_from(order + fmt, data, pos)
+            pos += size
+            return values if len(values) > 1 else values[0]
+
+        def read_bytes(length):
+            nonlocal pos
+            if pos + length > len(data):
+                raise ControlFileError(f"truncated control file at pos {pos}")
+            value = bytes(data[pos : pos + length])
+            pos += length
+            return value
+
+        _extension, info_hash_length = read("II")
+        info_hash = read_bytes(info_hash_length).hex() or None
+        piece_length, total_length, upload_length, bitfield_length = read("IQQI")
+        if not piece_length:
+            raise ControlFileError("invalid control file, piece length is 0")
+        num_pieces = -(-total_length // piece_length)
+        if bitfield_length != -(-num_pieces // 8):
+            raise ControlFileError(
+                f"invalid control file, bitfield of {bitfield_length} bytes"
+                f" for {num_pieces} pieces"
+            )
+        bitfield = read_bytes(bitfield_length)
+        in_flight = []
+        for _ in range(read("I")):
+            index, length, block_bitfield_length = read("III")
+            if index >= num_pieces:
+                raise ControlFileError(
+                    f"invalid control file, piece {index} in progress"
+                    f" of {num_pieces} pieces"
+                )
+            in_flight.append((index, length, read_bytes(block_bitfield_length)))
+        return cls(
+            version,
+            info_hash,
+            piece_length,
+            total_length,
+            upload_length,
+            bitfield,
+            in_flight,
+        )
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, "rb") as f:
+            return cls.parse(f.read())
+
+    @property
+    def num_pieces(self):
+        if not self.piece_length:
+            return 0
+        return -(-self.total_length // self.piece_length)
+
+    def has_piece(self, index):
+        return bool(self.bitfield[index >> 3] & (0x80 >> (index & 7)))
+
+    def piece_size(self, index):
+        return min(self.piece_length, self.total_length - index * self.piece_length)
+
+    @property
+    def completed_pieces(self):
+        return bin(int.from_bytes(self.bitfield, "big")).count("1")
+
+    @property
+    def completed_length(self):
+        """completed pieces and the completed blocks of the pieces in progress"""
+        pieces = self.num_pieces
+        length = self.completed_pieces * self.piece_length
+        if pieces and self.has_piece(pieces - 1):  # the last piece is shorter
+            length -= self.piece_length - self.piece_size(pieces - 1)
+        for index, piece_length, block_bitfield in self.in_flight:
+            blocks = bin(int.from_bytes(block_bitfield, "big")).count("1")
+            length += min(blocks * BLOCK_LENGTH, piece_length)
+        return min(length, self.total_length)
+
+    @property
+    def progress(self):
+        return self.completed_length / self.total_length if self.total_length else 0.0
+
+    def file_progress(self, lengths):
+        """
+        Completed length of each file, from the completed pieces only
+        :param lengths: [int], lengths of the files in the order of the torrent
+        :return: [int]
+        """
+        result = []
+        start = 0
+        for length in lengths:
+            end = start + length
+            completed = 0
+            if length and self.piece_length:
+                first = start // self.piece_length
+                last = (end - 1) // self.piece_length
+                for index in range(first, min(last + 1, self.num_pieces)):
+                    if self.has_piece(index):
+                        piece_start = index * self.piece_length
+                        completed += min(end, piece_start + self.piece_length) - max(
+                            start, piece_start
+                        )
+            result.append(completed)
+            start = end
+        return result
+
+
+def download_path(filename):
+    """the file or directory the control file belongs to"""
+    filename = Path(filename)
+    return filename.with_name(filename.name[: -len(CONTROL_FILE_SUFFIX)])
@@ -0,0 +1,142 @@
+import aria2p
+import json
+import logging
+import threading
+import time
+import websocket
+
+from aria2p.client import (
+    Notification,
+    NOTIFICATION_START,
+    NOTIFICATION_PAUSE,
+    NOTIFICATION_STOP,
+    NOTIFICATION_COMPLETE,
+    NOTIFICATION_ERROR,
+    NOTIFICATION_BT_COMPLETE,
+)
+
+from aria2rpc import STOPPED_STATUS
+
+
+# status of the task after the notification, None: status unchanged
+NOTIFICATION_STATUS = {
+    NOTIFICATION_START: "active",
+    NOTIFICATION_PAUSE: "paused",
+    NOTIFICATION_STOP: "removed",
+    NOTIFICATION_COMPLETE: "complete",
+    NOTIFICATION_ERROR: "error",
+    NOTIFICATION_BT_COMPLETE: None,  # still active (seeding)
+}
+
+
+class Aria2EventWatcher:
+    """Listen to aria2 notifications over WebSocket and keep a view of the queue"""
+
+    def __init__(self, client, timeout=1, debounce=1, on_notification=None):
+        """
+        :param client: aria2p.Client
+        :param timeout: int, timeout of WebSocket recv/connect
+        :param debounce: int, seconds to wait for a burst of notifications
+        :param on_notification: callable(type, gid), called from the listening thread
+        """
+        self.client = client
+        self.on_notification = on_notification
+        self.timeout = timeout
+        self.debounce = debounce
+        self.view = {}
+        self.changed = threading.Event()
+        self.connected = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+
+    def sync(self, tasks):
+        """replace the view by the tasks fetched from RPC"""
+        with self._lock:
+            self.view = {task.gid: task.status for task in tasks}
+        self.changed.clear()
+
+    def apply(self, gid, status):
+        """apply a notification to the view"""
+        with self._lock:
+            if status in STOPPED_STATUS:
+                self.view.pop(gid, None)
+            elif status:
+                self.view[gid] = status
+        self.changed.set()
+
+    def count(self, status):
+        with self._lock:
+            return sum(1 for s in self.view.values() if s == status)
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._listen, name="aria2-notifications", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self.is_alive():
+            self._thread.join(self.timeout * 2)
+
+    def _listen(self):
+        ws_server = self.client.ws_server
+        self.logger.debug(f"Connect to {ws_server}")
+        try:
+            socket = websocket.create_connection(ws_server, timeout=self.timeout)
+        except (OSError, websocket.WebSocketException) as e:
+            self.logger.warning(f"WebSocket {ws_server} connect failed: {e}")
+            return
+        self.connected.set()
+        try:
+            while not self._stopping.is_set():
+                try:
+                    message = socket.recv()
+                except websocket.WebSocketTimeoutException:
+                    continue
+                notification = Notification.get_or_raise(json.loads(message))
+                self.logger.debug(f"<<< {notification.type} {notification.gid}")
+                self.apply(notification.gid, NOTIFICATION_STATUS.get(notification.type))
+                if self.on_notification:
+                    self.on_notification(notification.type, notification.gid)
+        except (
+            OSError,
+            ValueError,
+            websocket.WebSocketException,
+            aria2p.client.ClientException,
+        ) as e:
+            self.logger.warning(f"WebSocket {ws_server} dropped: {e}")
+        finally:
+            self.connected.clear()
+            socket.close()
+
+    def wait(self, exit_event, interval):
+        """
+        Block until the view changed, the stall timer fired or the program is exiting.
+        Fall back to sleep `interval` seconds if the WebSocket is not connected.
+        :param exit_event: threading.Event
+        :param interval: int, stall timer, seconds
+        """
+        if not self.is_alive():
+            self.start()
+        if not self.connected.wait(self.timeout):
+            self.logger.warning(f"WebSocket not connected, sleep {interval}s.")
+            exit_event.wait(interval)
+            return
+        # no active task, nothing can stall: sleep until a notification
+        deadline = time.monotonic() + interval if self.count("active") else None
+        self.logger.info(
+            f"wait for notifications, timeout {interval if deadline else '-'}s."
+        )
+        while not exit_event.is_set() and self.connected.is_set():
+            if self.changed.wait(self.timeout):
+                exit_event.wait(self.debounce)  # a burst of notifications
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                break
@@ -0,0 +1,231 @@
+import base64
+import logging
+import re
+
+from pathlib import Path, PurePosixPath
+
+from aria2rpc import aria2p, multicall, WAITING_PAGE_SIZE
+from aria2rpc.torrent import BencodeError, TorrentMetadata
+
+
+# keys of the waiting tasks to rebalance, enough to add them again elsewhere
+REBALANCE_KEYS = [
+    "gid",
+    "status",
+    "completedLength",
+    "dir",
+    "infoHash",
+    "files",
+]
+REBALANCE_MAX_MOVES = 8
+# options kept when a task is added to another instance, "dir" see `rebalanced_dir`
+REBALANCE_OPTIONS = ("select-file", "max-download-limit", "max-upload-limit")
+
+
+def endpoint_filename(filename, name):
+    """file of an endpoint, e.g. stats.db -> stats.<name>.db"""
+    filename = Path(filename).expanduser()
+    safe_name = re.sub(r"[^\w.-]+", "_", name)
+    return filename.with_name(f"{filename.stem}.{safe_name}{filename.suffix}")
+
+
+def task_uris(struct):
+    """
+    :return: [str], URIs to add a non-BitTorrent task again,
+        None if the task cannot be added from URIs, e.g. a metalink of several files
+    """
+    files = struct.get("files", [])
+    if len(files) != 1:
+        return None
+    uris = list(dict.fromkeys(uri["uri"] for uri in files[0].get("uris", [])))
+    return uris or None
+
+
+def task_torrent(struct):
+    """
+    A magnet would make the target fetch the metadata again, forever for a private
+    torrent, the task is added from "<dir>/<info hash>.torrent" (--bt-save-metadata)
+    :return: str, base64 payload of addTorrent, None if the torrent is not readable
+        from here
+    """
+    info_hash = struct["infoHash"].lower()
+    filename = Path(struct.get("dir", "")) / f"{info_hash}.torrent"
+    try:
+        data = filename.read_bytes()
+        if TorrentMetadata(data).info_hash != info_hash:
+            return None
+    except (OSError, BencodeError):
+        return None
+    return base64.b64encode(data).decode("ascii")
+
+
+def rebalanced_dir(task_dir, source_dir, target_dir):
+    """
+    :param task_dir: str, "dir" of the task on the source instance
+    :param source_dir: str, "dir" of the source instance
+    :param target_dir: str, "dir" of the target instance
+    :return: str, "dir" of the task on the target instance, at the same place relative
+        to the instance's "dir", e.g. "<dir>/.tmp" of `add`; None: the target's "dir"
+    """
+    task_dir = PurePosixPath(task_dir)
+    try:
+        relative = task_dir.relative_to(source_dir)
+    except ValueError:  # out of the instance's dir, keep the layout of `add` only
+        relative = PurePosixPath(".tmp") if task_dir.name == ".tmp" else None
+    if relative is None or relative == PurePosixPath("."):
+        return None
+    return str(PurePosixPath(target_dir) / relative)
+
+
+class Rebalancer:
+    """
+    Move waiting tasks from a saturated aria2 instance to an idle one.
+    Saturated: tasks waiting and all the download slots used.
+    Idle: no task waiting and free download slots.
+    Only the tasks with nothing downloaded are moved, BitTorrent tasks only from
+    their .torrent saved by --bt-save-metadata, see `task_torrent`.
+    """
+
+    def __init__(self, apis, max_moves=REBALANCE_MAX_MOVES):
+        """
+        :param apis: {name: aria2p.API}
+        :param max_moves: int, max tasks moved per round
+        """
+        self.apis = apis
+        self.max_moves = max_moves
+        self.dirs = {}  # name -> "dir" of the instance, by `load`
+        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+
+    def load(self, name):
+        """:return: (active, waiting, max concurrent downloads) of the instance"""
+        client = self.apis[name].client
+        stat, options = multicall(
+            client, [(client.GET_GLOBAL_STAT, []), (client.GET_GLOBAL_OPTION, [])]
+        )
+        for r in (stat, options):
+            if isinstance(r, aria2p.client.ClientException):
+                raise r
+        self.dirs[name] = options.get("dir", "")
+        return (
+            int(stat["numActive"]),
+            int(stat["numWaiting"]),
+            int(options["max-concurrent-downloads"]),
+        )
+
+    def run(self):
+        """
+        One round, an instance failing is left out
+        :return: int, tasks moved
+        """
+        loads = {}
+        for name in self.apis:
+            try:
+                loads[name] = self.load(name)
+            except Exception as e:
+                self.logger.warning(f"[{name}] skip, load failed: {e!r}")
+        saturated = {
+            name: waiting
+            for name, (active, waiting, slots) in loads.items()
+            if waiting and active >= slots
+        }
+        idle = {
+            name: slots - active
+            for name, (active, waiting, slots) in loads.items()
+            if not waiting and active < slots
+        }
+        moved = 0
+        for target, free in sorted(idle.items(), key=lambda i: -i[1]):
+            if not saturated or moved >= self.max_moves:
+                break
+            source = max(saturated, key=saturated.get)
+            count = self.move(
+                source, target, min(free, saturated[source], self.max_moves - moved)
+            )
+            saturated[source] -= count
+            if saturated[source] <= 0 or not count:
+                saturated.pop(source)
+            moved += count
+        return moved
+
+    def add_call(self, client, struct):
+        """:return: (method, params) to add the task again without its options, or None"""
+        if struct.get("infoHash"):
+            torrent = task_torrent(struct)
+            if torrent is None:
+                self.logger.info(
+                    f"skip BitTorrent task {struct['gid']},"
+                    f" no {struct['infoHash']}.torrent in {struct.get('dir')}"
+                )
+                return None
+            return client.ADD_TORRENT, [torrent, []]
+        uris = task_uris(struct)
+        return (client.ADD_URI, [uris]) if uris else None
+
+    def move(self, source, target, count):
+        """
+        Move up to `count` tasks from the head of the waiting queue of source to target
+        :return: int, tasks moved
+        """
+        src = self.apis[source].client
+        dst = self.apis[target].client
+        structs = src.tell_waiting(0, min(WAITING_PAGE_SIZE, count * 4), REBALANCE_KEYS)
+        candidates = []
+        for struct in structs:
+            if len(candidates) >= count:
+                break
+            if struct["status"] != "waiting" or int(struct["completedLength"]):
+                continue
+            call = self.add_call(dst, struct)
+            if call:
+                candidates.append((struct, call))
+        if not candidates:
+            return 0
+        # paused, so that they do not start before they are removed
+        paused = multicall(
+            src, [(src.FORCE_PAUSE, [struct["gid"]]) for struct, _ in candidates]
+        )
+        candidates = [
+            candidate
+            for candidate, r in zip(candidates, paused)
+            if not isinstance(r, aria2p.client.ClientException)
+        ]
+        options = multicall(
+            src, [(src.GET_OPTION, [struct["gid"]]) for struct, _ in candidates]
+        )
+        calls = []
+        for (struct, (method, params)), r in zip(candidates, options):
+            task_options = {}
+            if not isinstance(r, aria2p.client.ClientException):
+                task_options = {k: r[k] for k in REBALANCE_OPTIONS if k in r}
+            # on-download-complete moves the tasks out of "<dir>/.tmp"
+            directory = rebalanced_dir(
+                struct.get("dir", ""),
+                self.dirs.get(source, ""),
+                self.dirs.get(target, ""),
+            )
+            if directory:
+                task_options["dir"] = directory
+            calls.append((method, [*params, task_options]))
+        try:
+            added = multicall(dst, calls)
+        except Exception:
+            multicall(src, [(src.UNPAUSE, [struct["gid"]]) for struct, _ in candidates])
+            raise
+        after = []  # remove the moved tasks, resume the others
+        for (struct, _), r in zip(candidates, added):
+            if isinstance(r, aria2p.client.ClientException):
+                self.logger.warning(
+                    f"[{target}] add {struct['gid']} failed: {r.message}"
+                )
+                after.append((src.UNPAUSE, [struct["gid"]]))
+                continue
+            self.logger.info(
+                f"[{source}] -> [{target}] move task {struct['gid']} as {r}"
+            )
+            after.append((src.REMOVE, [struct["gid"]]))
+        for (method, params), r in zip(after, multicall(src, after)):
+            if isinstance(r, aria2p.client.ClientException):
+                self.logger.warning(
+                    f"[{source}] {method} {params[0]} failed: {r.message}"
+                )
+        return sum(1 for method, _ in after if method == src.REMOVE)
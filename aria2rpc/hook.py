@@ -0,0 +1,174 @@
+import collections
+import errno
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import threading
+
+from pathlib import Path
+
+
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE_SIZE = 64
+# gids handled recently, a gid may come from both the shim and the notifications
+RECENT_SIZE = 1024
+
+
+class _ShimHandler(socketserver.StreamRequestHandler):
+    """one JSON line per gid, {"gid": ...}, answered by {"gid": ..., "queued": bool}"""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                gid = request["gid"]
+            except (ValueError, KeyError, TypeError) as e:
+                self._reply({"error": f"bad request: {e}"})
+                continue
+            self.server.hook_daemon.logger.info(f"[{gid}] Forwarded: {request}")
+            # blocks while the queue is full, the shim waits or gives up
+            self._reply({"gid": gid, "queued": self.server.hook_daemon.submit(gid)})
+
+    def _reply(self, response):
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+        self.wfile.flush()
+
+
+class HookDaemon:
+    """
+    Run the completion hook in a few worker threads from a bounded queue,
+    instead of a process per completed task. The gids come from the shim
+    over a Unix socket, see `forward`, and/or from `submit`.
+    """
+
+    def __init__(
+        self,
+        handler,
+        socket_path=None,
+        workers=DEFAULT_WORKERS,
+        queue_size=DEFAULT_QUEUE_SIZE,
+    ):
+        """
+        :param handler: callable(gid), the hook, called from the worker threads
+        :param socket_path: str, Unix socket listened for the shim, None: no socket
+        :param workers: int, hooks running at the same time
+        :param queue_size: int, gids waiting for a worker, `submit` blocks when full
+        """
+        self.handler = handler
+        self.socket_path = Path(socket_path) if socket_path else None
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self._pending = set()  # queued, running or handled recently
+        self._recent = collections.deque()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._server = None
+        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+
+    def submit(self, gid):
+        """
+        Queue the gid, block while the queue is full
+        :return: bool, False if the gid is already queued or handled recently
+        """
+        with self._lock:
+            if gid in self._pending:
+                return False
+            self._pending.add(gid)
+        self.queue.put(gid)
+        return True
+
+    def _done(self, gid):
+        with self._lock:
+            if len(self._recent) >= RECENT_SIZE:
+                self._pending.discard(self._recent.popleft())
+            self._recent.append(gid)
+
+    def _work(self):
+        while True:
+            gid = self.queue.get()
+            try:
+                if gid is None:
+                    return
+                self.handler(gid)
+            except Exception:
+                self.logger.exception(f"[{gid}] Hook failed.")
+            finally:
+                if gid is not None:
+                    self._done(gid)
+                self.queue.task_done()
+
+    def start(self):
+        """:raise OSError: EADDRINUSE, another service listens on the socket"""
+        if self.socket_path:
+            if self.socket_path.is_socket():
+                if is_listening(self.socket_path):
+                    raise OSError(
+                        errno.EADDRINUSE,
+                        "another service is listening",
+                        str(self.socket_path),
+                    )
+                self.socket_path.unlink()  # left by a crashed daemon
+            self._server = socketserver.ThreadingUnixStreamServer(
+                str(self.socket_path), _ShimHandler
+            )
+            self._server.daemon_threads = True
+            self._server.hook_daemon = self
+            os.chmod(self.socket_path, 0o600)
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"hook-worker-{i}")
+            thread.start()
+            self._threads.append(thread)
+        if self._server:
+            threading.Thread(
+                target=self._server.serve_forever, name="hook-socket", daemon=True
+            ).start()
+            self.logger.info(f"Listen on {self.socket_path}")
+
+    def stop(self):
+        """stop listening, run the queued hooks and wait for the workers"""
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self.socket_path.unlink(missing_ok=True)
+            self._server = None
+        for _ in self._threads:
+            self.queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads.clear()
+
+
+def is_listening(socket_path):
+    """:return: bool, a process accepts connections on the Unix socket"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(socket_path))
+        except OSError:
+            return False
+    return True
+
+
+def forward(socket_path, gid, timeout=60, **arguments):
+    """
+    The shim: send the gid to a running `HookDaemon`, stdlib only
+    :param arguments: logged by the daemon, e.g. the arguments of the hook
+    :return: dict, reply of the daemon, None if the daemon is not running or cannot
+        be reached, the caller runs the hook itself
+    :raise socket.timeout: the queue of the daemon stays full, it still gets the gid
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        try:
+            sock.connect(str(socket_path))
+            sock.sendall(json.dumps({"gid": gid, **arguments}).encode() + b"\n")
+        except OSError:  # not running, no permission, reset, timeout
+            return None
+        try:
+            return json.loads(sock.makefile("rb").readline())
+        except socket.timeout:
+            raise
+        except (OSError, ValueError):  # the daemon is gone before the reply
+            return None
@@ -0,0 +1,151 @@
+import json
+import logging
+import time
+
+from pathlib import Path
+
+from aria2rpc import aria2p, multicall, WAITING_PAGE_SIZE
+from aria2rpc.torrent import normalize_uri
+
+
+INDEX_KEYS = ["gid", "status", "infoHash"]
+# a download stopped by an error or removed may be added again, not a duplicate
+INDEX_STATUS = ("active", "waiting", "paused", "complete")
+logger = logging.getLogger(__name__)
+
+
+class TaskIndex:
+    """Tasks of aria2 indexed by BitTorrent info hash and normalized URI"""
+
+    def __init__(self, server=None):
+        self.server = server
+        self.cached = False  # loaded from the cache file, the hits need a confirmation
+        self.status = {}  # gid -> status
+        self.info_hashes = {}  # info hash -> gid
+        self.uris = {}  # normalized URI -> gid
+        self.keys = {}  # gid -> [(table, key)], to discard a task at once
+
+    def add(self, gid, status="waiting", info_hash=None, uris=()):
+        self.status[gid] = status
+        keys = self.keys.setdefault(gid, [])
+        if info_hash:
+            self.info_hashes[info_hash.lower()] = gid
+            keys.append((self.info_hashes, info_hash.lower()))
+        for uri in uris:
+            uri = normalize_uri(uri)
+            self.uris[uri] = gid
+            keys.append((self.uris, uri))
+
+    def discard(self, gid):
+        self.status.pop(gid, None)
+        for table, key in self.keys.pop(gid, ()):
+            if table.get(key) == gid:  # not taken by a later task
+                del table[key]
+
+    def lookup(self, info_hash=None, uri=None):
+        """
+        :return: str, gid of the queued task, None if not found
+        """
+        if info_hash and info_hash.lower() in self.info_hashes:
+            return self.info_hashes[info_hash.lower()]
+        if uri:
+            return self.uris.get(normalize_uri(uri))
+        return None
+
+    @classmethod
+    def fetch(cls, client, page_size=WAITING_PAGE_SIZE):
+        """
+        Fetch the tasks of INDEX_STATUS with a narrow key projection,
+        URIs only for non-BitTorrent tasks
+        :param client: aria2p.Client
+        :return: TaskIndex
+        """
+        stat = client.get_global_stat()
+        calls = [(client.TELL_ACTIVE, [INDEX_KEYS])]
+        for method, count in (
+            (client.TELL_WAITING, int(stat["numWaiting"])),
+            (client.TELL_STOPPED, int(stat["numStopped"])),
+        ):
+            # one more page, tasks may be added in the meantime
+            for offset in range(0, count + page_size, page_size):
+                calls.append((method, [offset, page_size, INDEX_KEYS]))
+        structs = []
+        for r in multicall(client, calls):
+            if isinstance(r, aria2p.client.ClientException):
+                raise r
+            structs.extend(r)
+
+        index = cls(client.server)
+        uri_tasks = []
+        for struct in structs:
+            if struct["status"] not in INDEX_STATUS:
+                continue
+            if struct.get("infoHash"):
+                index.add(struct["gid"], struct["status"], struct["infoHash"])
+            else:
+                uri_tasks.append(struct)
+        responses = multicall(
+            client, [(client.GET_URIS, [struct["gid"]]) for struct in uri_tasks]
+        )
+        for struct, r in zip(uri_tasks, responses):
+            if isinstance(r, aria2p.client.ClientException):  # removed in the meantime
+                continue
+            index.add(struct["gid"], struct["status"], uris=[u["uri"] for u in r])
+        logger.debug(
+            f"index {len(index.status)} tasks,"
+            f" {len(index.info_hashes)} info hashes, {len(index.uris)} URIs"
+        )
+        return index
+
+    def confirm(self, client, gids):
+        """
+        Check the tasks of a cached index are still there, drop the gone ones
+        :return: {gid: status}
+        """
+        gids = list(gids)
+        if not self.cached or not gids:
+            return {gid: self.status.get(gid) for gid in gids}
+        confirmed = {}
+        responses = multicall(
+            client, [(client.TELL_STATUS, [gid, ["gid", "status"]]) for gid in gids]
+        )
+        for gid, r in zip(gids, responses):
+            if isinstance(r, aria2p.client.ClientException):
+                self.discard(gid)
+            elif r["status"] not in INDEX_STATUS:  # stopped since the index is cached
+                self.discard(gid)
+            else:
+                self.status[gid] = confirmed[gid] = r["status"]
+        return confirmed
+
+    def save(self, filename):
+        filename = Path(filename).expanduser()
+        filename.parent.mkdir(parents=True, exist_ok=True)
+        tasks = {gid: [status, None, []] for gid, status in self.status.items()}
+        for info_hash, gid in self.info_hashes.items():
+            tasks[gid][1] = info_hash
+        for uri, gid in self.uris.items():
+            tasks[gid][2].append(uri)
+        tmp = filename.with_name(f"{filename.name}.tmp")
+        with open(tmp, "w", encoding="utf8") as f:
+            json.dump({"time": time.time(), "server": self.server, "tasks": tasks}, f)
+        tmp.replace(filename)
+
+    @classmethod
+    def load(cls, filename, server=None, max_age=300):
+        """
+        :return: TaskIndex, None if the cache is missing, expired or of another server
+        """
+        try:
+            with open(Path(filename).expanduser(), encoding="utf8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.debug(f"skip index cache {filename}: {e}")
+            return None
+        if data.get("server") != server or time.time() - data["time"] > max_age:
+            return None
+        index = cls(server)
+        index.cached = True
+        for gid, (status, info_hash, uris) in data["tasks"].items():
+            index.add(gid, status, info_hash, uris)
+        return index
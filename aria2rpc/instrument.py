@@ -0,0 +1,190 @@
+import json
+import logging
+import re
+import threading
+import time
+
+from contextlib import contextmanager
+
+from aria2rpc.lazy import lazy_import
+
+
+requests = lazy_import("requests")
+PATTERN_METHOD = re.compile(r'"method": "([^"]+)"')
+logger = logging.getLogger(__name__)
+
+
+class Instrumentation:
+    """
+    Timing of RPC calls and cycle phases, reported to hooks.
+    A hook is a callable receiving an event dict, the "event" key is one of:
+    - rpc: method, duration, bytes_received, error
+    - phase: phase, duration
+    - cycle: the summary of a cycle, see `end_cycle`
+    """
+
+    def __init__(self, hooks=None):
+        self.hooks = list(hooks or [])
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.cycle_start = time.monotonic()
+        self.calls = 0
+        self.bytes_received = 0
+        self.errors = 0
+        self.wait_time = 0.0
+        self.methods = {}  # method -> [calls, duration]
+        self.phases = {}  # phase -> duration
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def emit(self, event):
+        for hook in self.hooks:
+            try:
+                hook(event)
+            except Exception as e:  # a broken hook must not break the daemon
+                logger.warning(f"hook {hook!r} failed: {e!r}")
+
+    def instrument_client(self, client):
+        """replace `aria2p.Client.post` by a timed one, measure the response size"""
+        instrumentation = self
+        send = getattr(client, "send", None)  # aria2rpc.client.PooledClient
+        if send is None:
+
+            def send(payload):
+                return requests.post(
+                    client.server, data=payload, timeout=client.timeout
+                ).content
+
+        def post(payload):
+            match = PATTERN_METHOD.search(payload)
+            method = match.group(1) if match else "unknown"
+            start = time.monotonic()
+            size = 0
+            error = None
+            try:
+                content = send(payload)
+                size = len(content)
+                return json.loads(content)
+            except Exception as e:
+                error = type(e).__name__
+                raise
+            finally:
+                instrumentation.rpc(method, time.monotonic() - start, size, error)
+
+        client.post = post
+        return client
+
+    def rpc(self, method, duration, bytes_received=0, error=None):
+        with self._lock:
+            self.calls += 1
+            self.bytes_received += bytes_received
+            self.errors += error is not None
+            stat = self.methods.setdefault(method, [0, 0.0])
+            stat[0] += 1
+            stat[1] += duration
+        self.emit(
+            {
+                "event": "rpc",
+                "method": method,
+                "duration": duration,
+                "bytes_received": bytes_received,
+                "error": error,
+            }
+        )
+
+    def wait(self, duration):
+        """time blocked waiting for status changes"""
+        with self._lock:
+            self.wait_time += duration
+
+    @contextmanager
+    def phase(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            duration = time.monotonic() - start
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + duration
+            self.emit({"event": "phase", "phase": name, "duration": duration})
+
+    def start_cycle(self):
+        with self._lock:
+            self._reset()
+
+    def end_cycle(self):
+        """emit and return the summary of the cycle"""
+        with self._lock:
+            summary = {
+                "event": "cycle",
+                "duration": time.monotonic() - self.cycle_start,
+                "calls": self.calls,
+                "bytes_received": self.bytes_received,
+                "errors": self.errors,
+                "wait_time": self.wait_time,
+                "phases": dict(self.phases),
+                "methods": {
+                    method: {"calls": calls, "duration": duration}
+                    for method, (calls, duration) in self.methods.items()
+                },
+            }
+        self.emit(summary)
+        return summary
+
+
+class JsonLogHook:
+    """write events as JSON lines"""
+
+    def __init__(self, filename, events=("rpc", "phase", "cycle")):
+        self.file = open(filename, "a", encoding="utf8", buffering=1)
+        self.events = events
+
+    def __call__(self, event):
+        if event["event"] in self.events:
+            self.file.write(json.dumps({"time": time.time(), **event}) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+class MetricsHook:
+    """feed events to aria2rpc.metrics.Metrics"""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def __call__(self, event):
+        metrics = self.metrics
+        if event["event"] == "rpc":
+            metrics.observe(
+                "rpc_latency_seconds",
+                event["duration"],
+                "Latency of aria2 JSON-RPC requests",
+                method=event["method"],
+            )
+            metrics.inc(
+                "rpc_received_bytes_total",
+                event["bytes_received"],
+                "Bytes received from aria2 JSON-RPC",
+            )
+        elif event["event"] == "phase":
+            metrics.observe(
+                "phase_duration_seconds",
+                event["duration"],
+                "Duration of cycle phases",
+                phase=event["phase"],
+            )
+        elif event["event"] == "cycle":
+            metrics.observe(
+                "cycle_duration_seconds",
+                event["duration"],
+                "Duration of oversee cycles",
+            )
+            metrics.observe(
+                "confirm_wait_seconds",
+                event["wait_time"],
+                "Time blocked waiting for status changes per cycle",
+            )
@@ -0,0 +1,22 @@
+import importlib.util
+import sys
+
+
+def lazy_import(name):
+    """
+    Import a module on the first access to one of its attributes,
+    keep the startup of the command line tools and the hooks fast
+    :param name: str, module name
+    :return: module
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
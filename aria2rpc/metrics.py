@@ -0,0 +1,163 @@
+import logging
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+logger = logging.getLogger(__name__)
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(
+            k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        )
+        for k, v in labels
+    )
+    return "{" + pairs + "}"
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """Gauges, counters and histograms in the Prometheus text exposition format"""
+
+    def __init__(self, prefix="aria2rpc"):
+        self.prefix = prefix
+        self.types = {}  # name -> (type, help)
+        self.values = {}  # name -> {labels: value}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def _series(self, metric, metric_type, help_text):
+        name = f"{self.prefix}_{metric}"
+        if name not in self.types:
+            self.types[name] = (metric_type, help_text or name)
+            self.values[name] = {}
+        return self.values[name]
+
+    def set(self, metric, value, help_text=None, **labels):
+        with self._lock:
+            series = self._series(metric, "gauge", help_text)
+            series[tuple(sorted(labels.items()))] = value
+
+    def inc(self, metric, value=1, help_text=None, **labels):
+        with self._lock:
+            series = self._series(metric, "counter", help_text)
+            key = tuple(sorted(labels.items()))
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, metric, value, help_text=None, buckets=DEFAULT_BUCKETS, **labels):
+        with self._lock:
+            series = self._series(metric, "histogram", help_text)
+            key = tuple(sorted(labels.items()))
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def clear(self, metric, **labels):
+        """
+        drop all series of a metric, e.g. per-task gauges of tasks gone
+        :param labels: drop only the series with these labels
+        """
+        with self._lock:
+            series = self.values.get(f"{self.prefix}_{metric}", {})
+            if not labels:
+                series.clear()
+                return
+            for key in [k for k in series if set(labels.items()) <= set(k)]:
+                del series[key]
+
+    def labeled(self, **labels):
+        """:return: LabeledMetrics, a view adding the labels to all the series"""
+        return LabeledMetrics(self, **labels)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, (metric_type, help_text) in self.types.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in self.values[name].items():
+                    if metric_type != "histogram":
+                        lines.append(f"{name}{_labels(labels)} {value}")
+                        continue
+                    for bound, count in zip(value.buckets, value.counts):
+                        le = _labels(labels + (("le", bound),))
+                        lines.append(f"{name}_bucket{le} {count}")
+                    le = _labels(labels + (("le", "+Inf"),))
+                    lines.append(f"{name}_bucket{le} {value.count}")
+                    lines.append(f"{name}_sum{_labels(labels)} {value.sum}")
+                    lines.append(f"{name}_count{_labels(labels)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host="127.0.0.1"):
+        """serve /metrics over HTTP in a daemon thread"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(f"{self.address_string()} {format % args}")
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(
+            target=self._server.serve_forever, name="metrics", daemon=True
+        ).start()
+        logger.info(f"metrics: http://{host}:{port}/metrics")
+
+    def shutdown(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class LabeledMetrics:
+    """Metrics with constant labels, e.g. the endpoint of a queue manager in a fleet"""
+
+    def __init__(self, metrics, **labels):
+        self.metrics = metrics
+        self.labels = labels
+
+    def set(self, metric, value, help_text=None, **labels):
+        self.metrics.set(metric, value, help_text, **self.labels, **labels)
+
+    def inc(self, metric, value=1, help_text=None, **labels):
+        self.metrics.inc(metric, value, help_text, **self.labels, **labels)
+
+    def observe(self, metric, value, help_text=None, buckets=DEFAULT_BUCKETS, **labels):
+        self.metrics.observe(metric, value, help_text, buckets, **self.labels, **labels)
+
+    def clear(self, metric):
+        self.metrics.clear(metric, **self.labels)
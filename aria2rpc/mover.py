@@ -0,0 +1,517 @@
+import errno
+import hashlib
+import json
+import logging
+import os
+import shutil
+import stat
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+
+DEFAULT_WORKERS = 4
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+THROTTLED_CHUNK_SIZE = 4 * 1024 * 1024
+PART_SUFFIX = ".aria2rpc-part"
+JOURNAL_SUFFIX = ".aria2rpc-journal"
+# a copy is resumed from the last checkpoint, the part file is synced before it
+CHECKPOINT_SIZE = 256 * 1024 * 1024
+CHECKSUMS = ("xxh64", "blake2b")
+# copy_file_range is not supported between these files, fall back to sendfile
+COPY_FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP}
+logger = logging.getLogger(__name__)
+
+
+def same_device(src, dst):
+    """
+    :param dst: Path, the target, need not exist, its nearest existing parent is checked
+    """
+    dst = Path(dst)
+    while not dst.exists() and dst != dst.parent:
+        dst = dst.parent
+    return os.lstat(src).st_dev == os.stat(dst).st_dev
+
+
+def copy_data(src_fd, dst_fd, size, throttle=None, offset=0):
+    """
+    Copy in the kernel, copy_file_range, then sendfile, then read/write
+    :param throttle: callable(bytes), called after each chunk, may sleep
+    :param offset: int, position of the copy in both files, the position of dst_fd
+        must be at it for sendfile
+    :return: int, copied bytes
+    """
+    chunk_size = THROTTLED_CHUNK_SIZE if throttle else COPY_CHUNK_SIZE
+    throttle = throttle or (lambda n: None)
+    copied = 0
+    if hasattr(os, "copy_file_range"):
+        try:
+            while copied < size:
+                pos = offset + copied
+                n = os.copy_file_range(
+                    src_fd, dst_fd, min(chunk_size, size - copied), pos, pos
+                )
+                if not n:
+                    return copied
+                copied += n
+                throttle(n)
+            return copied
+        except OSError as e:
+            if copied or e.errno not in COPY_FALLBACK_ERRNOS:
+                raise
+    try:
+        while copied < size:
+            n = os.sendfile(
+                dst_fd, src_fd, offset + copied, min(chunk_size, size - copied)
+            )
+            if not n:
+                return copied
+            copied += n
+            throttle(n)
+        return copied
+    except OSError as e:
+        if copied or e.errno not in COPY_FALLBACK_ERRNOS:
+            raise
+    return copy_hashed(src_fd, dst_fd, size, throttle=throttle, offset=offset)
+
+
+def copy_hashed(src_fd, dst_fd, size, hasher=None, throttle=None, offset=0):
+    """
+    Copy through user space, hash the data on the way, the source is read once
+    :param hasher: hashlib-like object updated by the copied data, None: no hash
+    :return: int, copied bytes
+    """
+    chunk_size = THROTTLED_CHUNK_SIZE if throttle else COPY_CHUNK_SIZE
+    copied = 0
+    while copied < size:
+        data = os.pread(src_fd, min(chunk_size, size - copied), offset + copied)
+        if not data:
+            break
+        if hasher:
+            hasher.update(data)
+        view = memoryview(data)
+        written = 0
+        while written < len(data):
+            written += os.pwrite(dst_fd, view[written:], offset + copied + written)
+        copied += written
+        if throttle:
+            throttle(len(data))
+    return copied
+
+
+def new_hasher(checksum):
+    """
+    :param checksum: str, one of CHECKSUMS, xxh64 needs the optional xxhash package
+    """
+    if checksum == "xxh64":
+        import xxhash
+
+        return xxhash.xxh64()
+    return hashlib.new(checksum)
+
+
+def segment_hashes(path, checksum, length=None):
+    """
+    :return: [str], hex hash of each CHECKPOINT_SIZE segment of the first `length`
+        bytes, of the whole file if None
+    """
+    hashes = []
+    with open(path, "rb") as f:
+        remaining = length
+        while remaining is None or remaining > 0:
+            size = (
+                CHECKPOINT_SIZE
+                if remaining is None
+                else min(CHECKPOINT_SIZE, remaining)
+            )
+            hasher = new_hasher(checksum)
+            read = 0
+            while read < size:
+                data = f.read(min(COPY_CHUNK_SIZE, size - read))
+                if not data:
+                    break
+                hasher.update(data)
+                read += len(data)
+            if not read:
+                break
+            hashes.append(hasher.hexdigest())
+            if remaining is not None:
+                remaining -= read
+            if read < size:  # end of file
+                break
+    return hashes
+
+
+def content_hash(checksum, segments):
+    """
+    :param segments: [str], see `segment_hashes`
+    :return: str, hash of the segment hashes, the hash of a file kept in the journal
+    """
+    hasher = new_hasher(checksum)
+    for segment in segments:
+        hasher.update(bytes.fromhex(segment))
+    return hasher.hexdigest()
+
+
+class Journal:
+    """
+    Progress of a merge across devices, JSON lines next to the destination,
+    {"path": relative path, "size": ..., "mtime_ns": ..., "offset": ...} for a
+    checkpoint of a copy, "done": true and "hash" once the file is in place.
+    With a checksum a checkpoint also has the "segment" hash of the data from
+    "start" to "offset", chained into the "segments" of the record when read.
+    Removed when the merge is done, read by the next merge after a crash.
+    """
+
+    def __init__(self, dst):
+        self.path = dst.with_name(f".{dst.name}{JOURNAL_SUFFIX}")
+        self.records = {}
+        self._file = None
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, encoding="utf8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:  # the last line of a crash
+                        continue
+                    self.records[record["path"]] = self._chain(record)
+        except FileNotFoundError:
+            pass
+
+    def get(self, key, st):
+        """:return: dict, the record of the key if the source is unchanged, else {}"""
+        record = self.records.get(key, {})
+        if record.get("size") != st.st_size or record.get("mtime_ns") != st.st_mtime_ns:
+            return {}
+        return record
+
+    def _chain(self, record):
+        """the segment hashes of the previous checkpoint followed by the new one"""
+        if "segment" not in record:
+            return record
+        segments = []
+        if record["start"]:
+            prev = self.records.get(record["path"], {})
+            if (
+                prev.get("segments") is None
+                or prev.get("offset") != record["start"]
+                or any(
+                    prev.get(k) != record[k] for k in ("size", "mtime_ns", "checksum")
+                )
+            ):
+                return {**record, "segments": None}
+            segments = prev["segments"]
+        return {**record, "segments": [*segments, record["segment"]]}
+
+    def write(self, key, st, **record):
+        record = {"path": key, "size": st.st_size, "mtime_ns": st.st_mtime_ns, **record}
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf8")
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.records[key] = self._chain(record)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def remove(self):
+        self.close()
+        self.path.unlink(missing_ok=True)
+
+
+class Mover:
+    """
+    Move a file tree like `rsync -a --remove-source-files` followed by removing
+    the source: rename on the same device, copy in a thread pool across devices,
+    merge into the existing directories, replace the existing files.
+    Across devices the files already at the destination with the same size and
+    mtime are skipped, and the progress is kept in a `Journal` to resume after a crash.
+    """
+
+    def __init__(
+        self,
+        workers=DEFAULT_WORKERS,
+        mode_add=0,
+        progress=None,
+        throttle=None,
+        checksum=None,
+    ):
+        """
+        :param workers: int, files copied at the same time across devices
+        :param mode_add: int, permission bits added to the moved files and directories,
+            e.g. stat.S_IWGRP, applied during the walk
+        :param progress: callable(src, dst, size), called after each moved file,
+            size is None for a directory renamed at once
+        :param throttle: callable(bytes), called after each copied chunk, may sleep
+        :param checksum: str, one of CHECKSUMS, also compare the content of the files
+            with the same size and mtime, verify each copy against the hash of its
+            source before the rename, None: size and mtime
+        """
+        self.workers = workers
+        self.mode_add = mode_add
+        self.progress = progress
+        self.throttle = throttle
+        self.checksum = checksum
+        self._progress_lock = threading.Lock()  # progress of the copies is concurrent
+        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+
+    def merge(self, src, dst):
+        """
+        :param src: Path, file or directory
+        :param dst: Path, the new path of src, merged with it if it is a directory
+        :return: bool, all moved, the files failed to move are kept in src
+        """
+        src, dst = Path(src), Path(dst)
+        rename = same_device(src, dst)
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        if rename and (src.is_symlink() or not src.is_dir()):
+            return self._run(self._move_file, src, dst, rename)
+        if rename and not os.path.lexists(dst):
+            return self._run(self._rename_dir, src, dst)
+        journal = None if rename else Journal(dst)
+        if src.is_symlink() or not src.is_dir():
+            success = self._run(self._move_file, src, dst, rename, journal, src.name)
+            journal.remove() if success else journal.close()
+            return success
+
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="mover") as pool:
+            futures = []
+            for dirpath, dirnames, filenames in os.walk(src):
+                source = Path(dirpath)
+                target = dst / source.relative_to(src)
+                try:
+                    target.mkdir(exist_ok=True)
+                    self._add_mode(target)
+                except OSError as e:
+                    self.logger.warning(f"mkdir {target} failed: {e}")
+                    dirnames.clear()  # the files are kept in src
+                    continue
+                for name in list(dirnames):
+                    if rename and not os.path.lexists(target / name):
+                        dirnames.remove(name)
+                        futures.append(
+                            pool.submit(
+                                self._run,
+                                self._rename_dir,
+                                source / name,
+                                target / name,
+                            )
+                        )
+                for name in filenames:
+                    key = str(source.relative_to(src) / name)
+                    args = (
+                        self._move_file,
+                        source / name,
+                        target / name,
+                        rename,
+                        journal,
+                        key,
+                    )
+                    if rename:  # no I/O, no need of the pool
+                        futures.append(_Done(self._run(*args)))
+                    else:
+                        futures.append(pool.submit(self._run, *args))
+            success = all([future.result() for future in futures])
+
+        # bottom-up: the emptied directories, the directory times as rsync -a
+        for dirpath, _, _ in sorted(os.walk(src), key=lambda w: -len(w[0])):
+            source = Path(dirpath)
+            target = dst / source.relative_to(src)
+            try:
+                if target.is_dir():
+                    shutil.copystat(source, target)
+                    self._add_mode(target)
+                source.rmdir()
+            except OSError as e:
+                if e.errno != errno.ENOTEMPTY:
+                    self.logger.warning(f"rmdir {source} failed: {e}")
+        if journal:
+            journal.remove() if success else journal.close()
+        return success
+
+    def _run(self, func, *args):
+        try:
+            func(*args)
+            return True
+        except OSError as e:
+            self.logger.warning(f"move {args[0]} failed: {e}")
+            return False
+
+    def _add_mode(self, path):
+        if self.mode_add:
+            mode = os.lstat(path).st_mode
+            if (
+                not stat.S_ISLNK(mode)
+                and stat.S_IMODE(mode) & self.mode_add != self.mode_add
+            ):
+                os.chmod(path, stat.S_IMODE(mode) | self.mode_add)
+
+    def _rename_dir(self, src, dst):
+        if self.mode_add:
+            self._add_mode(src)
+            for dirpath, dirnames, filenames in os.walk(src):
+                for name in dirnames + filenames:
+                    self._add_mode(os.path.join(dirpath, name))
+        os.rename(src, dst)
+        self._report(src, dst, None)
+
+    def _move_file(self, src, dst, rename, journal=None, key=None):
+        st = os.lstat(src)
+        if rename:
+            self._add_mode(src)
+            os.replace(src, dst)
+        else:
+            self._copy_file(src, dst, st, journal, key)
+            os.unlink(src)
+        self._report(src, dst, st.st_size)
+
+    def _report(self, src, dst, size):
+        if self.progress:
+            with self._progress_lock:
+                self.progress(src, dst, size)
+
+    def _is_copied(self, src, dst, st, record):
+        """dst is a copy of src, by size and mtime, by hash with `checksum`"""
+        try:
+            dst_st = os.lstat(dst)
+        except FileNotFoundError:
+            return False
+        if (
+            not stat.S_ISREG(dst_st.st_mode)
+            or dst_st.st_size != st.st_size
+            or dst_st.st_mtime_ns != st.st_mtime_ns
+        ):
+            return False
+        if not self.checksum:
+            return True
+        if (
+            record.get("done")
+            and record.get("checksum") == self.checksum
+            and record.get("hash")
+        ):  # hash of src by the copy, src is unchanged since
+            segments = segment_hashes(dst, self.checksum)
+            return content_hash(self.checksum, segments) == record["hash"]
+        return segment_hashes(src, self.checksum) == segment_hashes(dst, self.checksum)
+
+    def _copy_file(self, src, dst, st, journal=None, key=None):
+        """
+        Copy to a part file then rename, dst is never half written.
+        The part file is synced at each CHECKPOINT_SIZE and the offset journaled,
+        a copy interrupted by a crash is resumed from the last checkpoint.
+        With `checksum` the source is hashed as it is copied, by segment of
+        CHECKPOINT_SIZE journaled at each checkpoint, then the part file is read
+        back and compared with it before the rename.
+        """
+        record = journal.get(key, st) if journal else {}
+        if stat.S_ISREG(st.st_mode) and self._is_copied(src, dst, st, record):
+            self.logger.debug(f"skip {src}, {dst} has the same content")
+            return
+        part = dst.with_name(f".{dst.name}{PART_SUFFIX}")
+        if stat.S_ISLNK(st.st_mode):
+            part.unlink(missing_ok=True)
+            os.symlink(os.readlink(src), part)
+            os.replace(part, dst)
+            return
+
+        offset = 0
+        if record.get("offset"):
+            try:
+                if part.stat().st_size >= record["offset"]:
+                    offset = record["offset"]
+                    self.logger.info(f"resume {src} at {offset}")
+            except FileNotFoundError:
+                pass
+        segments = []  # hashes of the source, by segment
+        if offset and self.checksum:
+            if (
+                record.get("checksum") == self.checksum
+                and record.get("segments") is not None
+            ):
+                segments = list(record["segments"])
+            else:  # journaled without the hashes, the copied part is read once more
+                segments = segment_hashes(src, self.checksum, offset)
+        try:
+            with open(src, "rb") as fsrc, open(part, "r+b" if offset else "wb") as fdst:
+                fdst.truncate(offset)
+                pos = offset
+                while pos < st.st_size:
+                    length = min(CHECKPOINT_SIZE, st.st_size - pos)
+                    os.lseek(fdst.fileno(), pos, os.SEEK_SET)
+                    if self.checksum:
+                        hasher = new_hasher(self.checksum)
+                        n = copy_hashed(
+                            fsrc.fileno(),
+                            fdst.fileno(),
+                            length,
+                            hasher,
+                            self.throttle,
+                            pos,
+                        )
+                    else:
+                        n = copy_data(
+                            fsrc.fileno(), fdst.fileno(), length, self.throttle, pos
+                        )
+                    if n != length:
+                        raise OSError(
+                            errno.EIO,
+                            f"copied {pos + n} of {st.st_size} bytes",
+                            str(src),
+                        )
+                    pos += n
+                    os.fsync(fdst.fileno())
+                    checkpoint = {}
+                    if self.checksum:
+                        segments.append(hasher.hexdigest())
+                        checkpoint = {
+                            "checksum": self.checksum,
+                            "start": pos - n,
+                            "segment": segments[-1],
+                        }
+                    if journal and pos < st.st_size:
+                        journal.write(key, st, offset=pos, **checkpoint)
+            if self.checksum:
+                copied = segment_hashes(part, self.checksum)
+                if copied != segments:
+                    part.unlink()  # the resumed part may be the corrupted one
+                    bad = next(
+                        (i for i, (a, b) in enumerate(zip(copied, segments)) if a != b),
+                        min(len(copied), len(segments)),
+                    )
+                    raise OSError(
+                        errno.EIO,
+                        f"{self.checksum} of the copy differs"
+                        f" from byte {bad * CHECKPOINT_SIZE}",
+                        str(src),
+                    )
+            shutil.copystat(src, part)
+            self._add_mode(part)
+            os.replace(part, dst)
+        except BaseException:
+            if not (journal and journal.get(key, st).get("offset")):
+                part.unlink(missing_ok=True)
+            raise
+        if journal:
+            journal.write(
+                key,
+                st,
+                done=True,
+                checksum=self.checksum,
+                hash=content_hash(self.checksum, segments) if self.checksum else None,
+            )
+
+
+class _Done:
+    """a finished future"""
+
+    def __init__(self, result):
+        self._result = result
+
+    def result(self):
+        return self._result
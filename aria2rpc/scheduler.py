@@ -0,0 +1,203 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from pathlib import Path
+
+
+DEFAULT_DEVICE_LIMIT = 1
+
+
+class Throttle:
+    """token bucket shared by the copies of a device, bytes/s"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __call__(self, nbytes):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._last) * self.rate
+            )
+            self._last = now
+            self._tokens -= nbytes
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+
+def job_devices(job):
+    """
+    :return: frozenset, devices read and written by the job, one device if it is a rename
+    """
+    devices = set()
+    for path in [*job["paths"], job["destination"]]:
+        path = Path(path)
+        while not path.exists() and path != path.parent:
+            path = path.parent
+        devices.add(os.stat(path).st_dev)
+    return frozenset(devices)
+
+
+class MoveScheduler:
+    """
+    Run the moves of the completed tasks, the smallest first, with at most
+    `device_limit` copies reading or writing a device at the same time.
+    A rename on one device does no I/O, it is not limited.
+    The queued and running jobs are saved to `queue_file`, loaded by `start`.
+    """
+
+    def __init__(
+        self, runner, device_limit=DEFAULT_DEVICE_LIMIT, bandwidth=0, queue_file=None
+    ):
+        """
+        :param runner: callable(job, throttle=...) -> bool, throttle is None if unlimited
+        :param device_limit: int, copies per device at the same time
+        :param bandwidth: int, bytes/s per device shared by its copies, 0: unlimited
+        :param queue_file: str, JSON file of the jobs, None: not persisted
+        """
+        self.runner = runner
+        self.device_limit = device_limit
+        self.bandwidth = bandwidth
+        self.queue_file = Path(queue_file).expanduser() if queue_file else None
+        self._cond = threading.Condition()
+        self._queued = []  # [(size, seq, job)]
+        self._jobs = {}  # gid -> job, queued and running
+        self._busy = {}  # device -> running copies
+        self._throttles = {}  # device -> Throttle
+        self._threads = set()
+        self._seq = 0
+        self._stopping = False
+        self._dispatcher = None
+        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+
+    def submit(self, job):
+        """
+        :param job: dict, "gid", "paths", "destination", "size", JSON serializable,
+            passed to the runner
+        :return: bool, False if a job of the gid is already queued or running
+        """
+        with self._cond:
+            if job["gid"] in self._jobs:
+                return False
+            self._jobs[job["gid"]] = job
+            self._queued.append((job.get("size", 0), self._seq, job))
+            self._seq += 1
+            self._save()
+            self._cond.notify_all()
+        self.logger.info(f"[{job['gid']}] Queued move of {job.get('size', 0)} bytes")
+        return True
+
+    def start(self):
+        if self.queue_file and self.queue_file.exists():
+            try:
+                with open(self.queue_file, encoding="utf8") as f:
+                    jobs = json.load(f)
+            except (OSError, ValueError) as e:
+                self.logger.warning(f"skip move queue {self.queue_file}: {e}")
+                jobs = []
+            self.logger.info(f"Resume {len(jobs)} moves from {self.queue_file}")
+            for job in jobs:
+                self.submit(job)
+        self._stopping = False
+        self._dispatcher = threading.Thread(
+            target=self._dispatch, name="move-scheduler", daemon=True
+        )
+        self._dispatcher.start()
+
+    def stop(self):
+        """wait for the running moves, the queued ones stay in the queue file"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._dispatcher:
+            self._dispatcher.join()
+        for thread in list(self._threads):
+            thread.join()
+
+    def join(self):
+        """wait until all the jobs are done"""
+        with self._cond:
+            self._cond.wait_for(lambda: not self._jobs)
+
+    def _save(self):
+        if not self.queue_file:
+            return
+        self.queue_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.queue_file.with_name(f"{self.queue_file.name}.tmp")
+        with open(tmp, "w", encoding="utf8") as f:
+            json.dump(list(self._jobs.values()), f)
+        tmp.replace(self.queue_file)
+
+    def _next(self):
+        """the smallest job whose devices are free, None if all are blocked"""
+        for item in sorted(self._queued, key=lambda i: i[:2]):
+            job = item[2]
+            try:
+                devices = job_devices(job)
+            except OSError:
+                devices = frozenset()
+            if len(devices) > 1 and any(
+                self._busy.get(d, 0) >= self.device_limit for d in devices
+            ):
+                continue
+            self._queued.remove(item)
+            return job, devices if len(devices) > 1 else frozenset()
+        return None
+
+    def _dispatch(self):
+        with self._cond:
+            while True:
+                picked = None
+                while not self._stopping and picked is None:
+                    picked = self._next()
+                    if picked is None:
+                        self._cond.wait()
+                if self._stopping:
+                    return
+                job, devices = picked
+                for device in devices:
+                    self._busy[device] = self._busy.get(device, 0) + 1
+                thread = threading.Thread(
+                    target=self._run, args=(job, devices), name=f"move-{job['gid']}"
+                )
+                self._threads.add(thread)
+                thread.start()
+
+    def _throttle(self, devices):
+        if not self.bandwidth or not devices:
+            return None
+        throttles = [
+            self._throttles.setdefault(d, Throttle(self.bandwidth)) for d in devices
+        ]
+        return lambda nbytes: [throttle(nbytes) for throttle in throttles]
+
+    def _run(self, job, devices):
+        gid = job["gid"]
+        start = time.monotonic()
+        try:
+            with self._cond:
+                throttle = self._throttle(devices)
+            success = self.runner(job, throttle=throttle)
+        except Exception:
+            self.logger.exception(f"[{gid}] Move failed.")
+            success = False
+        self.logger.info(
+            f"[{gid}] Move {'done' if success else 'failed'}"
+            f" in {time.monotonic() - start:.1f}s"
+        )
+        with self._cond:
+            for device in devices:
+                self._busy[device] -= 1
+            # a failed move keeps the files in place, not retried
+            self._jobs.pop(gid, None)
+            self._save()
+            self._threads.discard(threading.current_thread())
+            self._cond.notify_all()
@@ -0,0 +1,168 @@
+from array import array
+from collections import OrderedDict
+
+
+class RingBuffer:
+    """Fixed-size ring buffer of (timestamp, completed length) samples"""
+
+    __slots__ = ("times", "values", "head", "size", "ewma")
+
+    def __init__(self, capacity):
+        self.times = array("d", bytes(8 * capacity))
+        self.values = array("d", bytes(8 * capacity))
+        self.head = 0  # next slot to write
+        self.size = 0
+        self.ewma = None  # moving average of speed, bytes/s
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def capacity(self):
+        return len(self.times)
+
+    def append(self, timestamp, value):
+        self.times[self.head] = timestamp
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+
+    def __getitem__(self, i):
+        """i-th sample, 0 is the oldest, -1 is the latest"""
+        if not -self.size <= i < self.size:
+            raise IndexError(i)
+        pos = (self.head - self.size + i % self.size) % self.capacity
+        return self.times[pos], self.values[pos]
+
+
+class TaskStatistics:
+    """Speed history of tasks, a ring buffer of samples per gid"""
+
+    def __init__(
+        self, window=3, alpha=0.5, max_records=10000, store=None, resume_gap=3600
+    ):
+        """
+        :param window: int, samples kept per task, the stall decision needs a full window
+        :param alpha: float, smoothing factor of EWMA speed
+        :param max_records: int, max count of speeds recorded for tasks not active
+        :param store: aria2rpc.store.SampleStore, persist samples and records
+        :param resume_gap: int, seconds, stored samples older than it are stale
+        """
+        self.window = max(window, 2)
+        self.alpha = alpha
+        self.history = {}
+        self.max_records = max_records
+        self.store = store
+        self.resume_gap = resume_gap
+        self._records = None  # gid -> last known speed, loaded from store on first use
+        # gids sampled since start, their stored samples were resumed or are stale
+        self._seen = set()
+
+    @property
+    def records(self):
+        if self._records is None:
+            self._records = OrderedDict(
+                self.store.load_records(self.max_records) if self.store else []
+            )
+        return self._records
+
+    def __len__(self):
+        return len(self.history)
+
+    def __contains__(self, gid):
+        return gid in self.history
+
+    def get(self, gid):
+        return self.history.get(gid)
+
+    def add(self, gid, timestamp, completed_length, **fields):
+        """
+        :param timestamp: float, wall clock time, samples are persisted across restarts
+        :param fields: download_speed, upload_speed, connections, only for the store
+        """
+        samples = self.history.get(gid)
+        if samples is None:
+            samples = self.history[gid] = RingBuffer(self.window)
+            # resume the history before restart, not the one evicted by `retain`
+            if self.store and gid not in self._seen:
+                for prev_time, prev_length in self.store.load(
+                    gid, self.window - 1, since=timestamp - self.resume_gap
+                ):
+                    self._append(samples, prev_time, prev_length)
+        self._seen.add(gid)
+        if self.store:
+            self.store.add(gid, timestamp, completed_length, **fields)
+        return self._append(samples, timestamp, completed_length)
+
+    def _append(self, samples, timestamp, completed_length):
+        if samples:
+            prev_time, prev_length = samples[-1]
+            if timestamp > prev_time:
+                speed = (completed_length - prev_length) / (timestamp - prev_time)
+                samples.ewma = (
+                    speed
+                    if samples.ewma is None
+                    else self.alpha * speed + (1 - self.alpha) * samples.ewma
+                )
+        samples.append(timestamp, completed_length)
+        return samples
+
+    def increment(self, gid):
+        """completed length between the latest two samples"""
+        samples = self.history.get(gid)
+        if samples is None or len(samples) < 2:
+            return None
+        return samples[-1][1] - samples[-2][1]
+
+    def rate(self, gid):
+        """average speed over the window, bytes/s"""
+        samples = self.history.get(gid)
+        if samples is None or len(samples) < 2:
+            return None
+        (first_time, first_length), (last_time, last_length) = samples[0], samples[-1]
+        if last_time <= first_time:
+            return None
+        return (last_length - first_length) / (last_time - first_time)
+
+    def ewma(self, gid):
+        samples = self.history.get(gid)
+        return None if samples is None else samples.ewma
+
+    def speed(self, gid):
+        """EWMA speed of an active task, or the last known speed of a task, bytes/s"""
+        ewma = self.ewma(gid)
+        return self.records.get(gid) if ewma is None else ewma
+
+    def record(self, gid, speed):
+        if self.store:
+            self.store.record(gid, speed)
+        self.records[gid] = speed
+        self.records.move_to_end(gid)
+        while len(self.records) > self.max_records:
+            self.records.popitem(last=False)
+
+    def is_stalled(self, gid, min_speed=0):
+        """the window is full and the average speed over it is not above `min_speed`"""
+        samples = self.history.get(gid)
+        if samples is None or len(samples) < self.window:
+            return False
+        rate = self.rate(gid)
+        return rate is not None and rate <= min_speed
+
+    def retain(self, gids, known=None):
+        """
+        Evict the history of tasks not in `gids`, their last speed is kept as a record
+        :param gids: [str], active tasks
+        :param known: [str], tasks in queue, records of other tasks are evicted
+        """
+        gids = set(gids)
+        for gid in [gid for gid in self.history if gid not in gids]:
+            samples = self.history.pop(gid)
+            if samples.ewma is not None:
+                self.record(gid, samples.ewma)
+        if known is not None:
+            known = set(known)
+            for gid in [gid for gid in self.records if gid not in known]:
+                del self.records[gid]
+            self._seen &= known | gids
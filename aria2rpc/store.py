@@ -0,0 +1,141 @@
+import logging
+import sqlite3
+import time
+
+from pathlib import Path
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    gid TEXT NOT NULL,
+    ts REAL NOT NULL,
+    completed_length INTEGER NOT NULL,
+    download_speed INTEGER NOT NULL DEFAULT 0,
+    upload_speed INTEGER NOT NULL DEFAULT 0,
+    connections INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS samples_gid_ts ON samples (gid, ts);
+CREATE TABLE IF NOT EXISTS records (
+    gid TEXT PRIMARY KEY,
+    speed REAL NOT NULL,
+    ts REAL NOT NULL
+);
+"""
+
+
+class SampleStore:
+    """SQLite store of task samples and recorded speeds, written in batches"""
+
+    def __init__(
+        self,
+        filename,
+        retention=7 * 86400,
+        keep_samples=64,
+        compact_interval=3600,
+    ):
+        """
+        :param filename: str, path of SQLite database
+        :param retention: int, seconds, older samples and records are removed on compaction
+        :param keep_samples: int, max samples kept per gid on compaction
+        :param compact_interval: int, seconds between compactions
+        """
+        self.filename = Path(filename).expanduser()
+        self.retention = retention
+        self.keep_samples = keep_samples
+        self.compact_interval = compact_interval
+        self.pending_samples = []
+        self.pending_records = {}
+        self.last_compact = None
+        self._db = None
+        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+
+    @property
+    def db(self):
+        """open the database on first use"""
+        if self._db is None:
+            self.filename.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(self.filename)
+            self._db.executescript(SCHEMA)
+            self.logger.info(f"stats db: {self.filename}")
+        return self._db
+
+    def add(
+        self, gid, ts, completed_length, download_speed=0, upload_speed=0, connections=0
+    ):
+        self.pending_samples.append(
+            (gid, ts, completed_length, download_speed, upload_speed, connections)
+        )
+
+    def record(self, gid, speed, ts=None):
+        self.pending_records[gid] = (gid, speed, time.time() if ts is None else ts)
+
+    def load(self, gid, limit, since=0):
+        """
+        :return: [(ts, completed_length)], the latest `limit` samples of the gid
+            taken after `since`, oldest first
+        """
+        rows = self.db.execute(
+            "SELECT ts, completed_length FROM samples"
+            " WHERE gid = ? AND ts > ? ORDER BY ts DESC LIMIT ?",
+            (gid, since, limit),
+        ).fetchall()
+        return rows[::-1]
+
+    def load_records(self, limit):
+        """
+        :return: [(gid, speed)], the latest `limit` records, oldest first
+        """
+        rows = self.db.execute(
+            "SELECT gid, speed FROM records ORDER BY ts DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return rows[::-1]
+
+    def flush(self):
+        """write pending samples and records in one transaction"""
+        if not self.pending_samples and not self.pending_records:
+            return
+        with self.db:
+            self.db.executemany(
+                "INSERT INTO samples VALUES (?, ?, ?, ?, ?, ?)", self.pending_samples
+            )
+            self.db.executemany(
+                "INSERT OR REPLACE INTO records VALUES (?, ?, ?)",
+                self.pending_records.values(),
+            )
+        self.logger.debug(
+            f"flush {len(self.pending_samples)} samples, {len(self.pending_records)} records"
+        )
+        self.pending_samples = []
+        self.pending_records = {}
+        now = time.monotonic()
+        if (
+            self.last_compact is None
+            or now - self.last_compact >= self.compact_interval
+        ):
+            self.compact()
+            self.last_compact = now
+
+    def compact(self):
+        """remove expired rows, keep the latest `keep_samples` samples per gid"""
+        expired = time.time() - self.retention
+        with self.db:
+            self.db.execute("DELETE FROM samples WHERE ts < ?", (expired,))
+            self.db.execute("DELETE FROM records WHERE ts < ?", (expired,))
+            self.db.execute(
+                "DELETE FROM samples WHERE rowid IN ("
+                " SELECT rowid FROM ("
+                "  SELECT rowid, ROW_NUMBER() OVER (PARTITION BY gid ORDER BY ts DESC) AS n"
+                "  FROM samples"
+                " ) WHERE n > ?"
+                ")",
+                (self.keep_samples,),
+            )
+        self.db.execute("VACUUM")
+        self.logger.info(f"compact stats db: {self.filename}")
+
+    def close(self):
+        self.flush()
+        if self._db is None:
+            return
+        self._db.close()
+        self._db = None
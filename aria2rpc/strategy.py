@@ -0,0 +1,183 @@
+import random
+
+from statistics import median
+
+
+# a task is slow if its speed is below this ratio of the median speed of active tasks
+SLOW_RATIO = 0.1
+
+
+def _int_key(task, key):
+    """int value of the task struct, 0 if the key is missing (e.g. numSeeders of a non-BT task)"""
+    try:
+        return int(task._struct.get(key, 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+def remaining_length(task):
+    return task.total_length - task.completed_length
+
+
+class SwapStrategy:
+    """
+    Strategy of task swap.
+    `swap_out` picks the active tasks to move to the bottom of the queue,
+    `promote` picks the waiting tasks to move to the top, so that aria2 starts them next.
+    """
+
+    name = None
+    description = None
+
+    def __init__(self, statistics, stall_speed=0):
+        """
+        :param statistics: aria2rpc.stats.TaskStatistics
+        :param stall_speed: int, bytes/s
+        """
+        self.statistics = statistics
+        self.stall_speed = stall_speed
+
+    def is_stalled(self, task):
+        return self.statistics.is_stalled(task.gid, self.stall_speed)
+
+    def slow_tasks(self, task_list):
+        """tasks with a full window, and stalled or much slower than the median, slowest first"""
+        rates = {}
+        for task in task_list:
+            samples = self.statistics.get(task.gid)
+            if samples is None or len(samples) < self.statistics.window:
+                continue
+            rate = self.statistics.rate(task.gid)
+            if rate is not None:
+                rates[task.gid] = rate
+        if not rates:
+            return []
+        threshold = max(self.stall_speed, SLOW_RATIO * median(rates.values()))
+        slow = [
+            task
+            for task in task_list
+            if rates.get(task.gid, threshold + 1) <= threshold
+        ]
+        return sorted(slow, key=lambda task: rates[task.gid])
+
+    def swap_out(self, task_list, max_count):
+        """
+        :param task_list: [aria2p.downloads.Download], active tasks
+        :param max_count: int
+        :return: [aria2p.downloads.Download]
+        """
+        raise NotImplementedError
+
+    def promote(self, task_list, count):
+        """
+        :param task_list: [aria2p.downloads.Download], waiting tasks in queue order
+        :param count: int, count of tasks swapped out
+        :return: [aria2p.downloads.Download], empty to keep the queue order
+        """
+        return []
+
+
+class StalledStrategy(SwapStrategy):
+    name = "stalled"
+    description = "swap out stalled tasks, keep the queue order"
+
+    def swap_out(self, task_list, max_count):
+        return [task for task in task_list if self.is_stalled(task)][:max_count]
+
+
+class SlowestStrategy(SwapStrategy):
+    name = "slowest"
+    description = "swap out stalled and slow tasks, lowest windowed rate first"
+
+    def swap_out(self, task_list, max_count):
+        return self.slow_tasks(task_list)[:max_count]
+
+
+class SwarmStrategy(SwapStrategy):
+    name = "swarm"
+    description = "swap out stalled and slow tasks, fewest seeders/connections first"
+
+    def swap_out(self, task_list, max_count):
+        slow = self.slow_tasks(task_list)
+        slow.sort(
+            key=lambda task: (
+                _int_key(task, "numSeeders"),
+                _int_key(task, "connections"),
+            )
+        )
+        return slow[:max_count]
+
+
+class SmallestStrategy(SwapStrategy):
+    name = "smallest"
+    description = "swap out stalled tasks, promote waiting tasks with the smallest remaining bytes"
+
+    def swap_out(self, task_list, max_count):
+        return [task for task in task_list if self.is_stalled(task)][:max_count]
+
+    def promote(self, task_list, count):
+        # the size of a magnet task is unknown before the metadata is downloaded
+        known = [task for task in task_list if task.total_length]
+        return sorted(known, key=remaining_length)[:count]
+
+
+class BanditStrategy(SwapStrategy):
+    name = "bandit"
+    description = (
+        "swap out stalled and slow tasks, promote the fastest known waiting tasks "
+        "and sometimes unknown ones to explore"
+    )
+
+    def __init__(self, statistics, stall_speed=0, epsilon=0.2, rng=None):
+        """
+        :param epsilon: float, probability to explore a waiting task never measured
+        """
+        super().__init__(statistics, stall_speed)
+        self.epsilon = epsilon
+        self.rng = rng or random.Random()
+
+    def swap_out(self, task_list, max_count):
+        return self.slow_tasks(task_list)[:max_count]
+
+    def promote(self, task_list, count):
+        known = []
+        unknown = []
+        for task in task_list:
+            speed = self.statistics.speed(task.gid)
+            if speed is None:
+                unknown.append(task)
+            elif speed > self.stall_speed:
+                known.append((speed, task))
+        known = [task for _, task in sorted(known, key=lambda x: x[0], reverse=True)]
+        self.rng.shuffle(unknown)
+        selected = []
+        for _ in range(count):
+            explore = unknown and (not known or self.rng.random() < self.epsilon)
+            pool = unknown if explore else known
+            if not pool:
+                break
+            selected.append(pool.pop(0))
+        return selected
+
+
+STRATEGIES = {
+    cls.name: cls
+    for cls in (
+        StalledStrategy,
+        SlowestStrategy,
+        SwarmStrategy,
+        SmallestStrategy,
+        BanditStrategy,
+    )
+}
+DEFAULT_STRATEGY = StalledStrategy.name
+
+
+def get_strategy(name, statistics, stall_speed=0):
+    try:
+        cls = STRATEGIES[name]
+    except KeyError:
+        raise ValueError(
+            f'Unknown strategy "{name}", available: {", ".join(STRATEGIES)}'
+        ) from None
+    return cls(statistics, stall_speed=stall_speed)
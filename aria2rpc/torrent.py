@@ -0,0 +1,288 @@
+import base64
+import binascii
+import hashlib
+import mmap
+import re
+
+from collections import namedtuple
+from contextlib import contextmanager
+from urllib.parse import parse_qs, urlsplit, urlunsplit
+
+
+PATTERN_BTIH = re.compile(r"urn:btih:([0-9a-z]+)", re.IGNORECASE)
+PATTERN_INT = re.compile(rb"-?[0-9]+")
+DEFAULT_PORTS = {"http": 80, "https": 443, "ftp": 21, "ftps": 990, "sftp": 22}
+
+
+TorrentFile = namedtuple("TorrentFile", ["index", "path", "length"])
+
+
+class BencodeError(ValueError):
+    pass
+
+
+def skip_value(data, pos):
+    """
+    :param data: bytes, bencoded data
+    :param pos: int, start of a value
+    :return: int, end of the value
+    """
+    depth = 0
+    while True:
+        c = data[pos : pos + 1]
+        if c in (b"d", b"l"):
+            depth += 1
+            pos += 1
+            continue
+        if c == b"e":
+            if not depth:
+                raise BencodeError(f"unexpected end at pos {pos}")
+            depth -= 1
+            pos += 1
+        elif c == b"i":
+            end = data.find(b"e", pos)
+            if end < 0:
+                raise BencodeError(f"unterminated integer at pos {pos}")
+            pos = end + 1
+        elif c.isdigit():
+            _, pos = string_span(data, pos)
+        else:
+            raise BencodeError(f"invalid value at pos {pos}")
+        if not depth:
+            return pos
+
+
+def string_span(data, pos):
+    """:return: (start, end) of the content of the string at pos"""
+    colon = data.find(b":", pos)
+    if colon < 0 or not data[pos:colon].isdigit():
+        raise BencodeError(f"invalid string at pos {pos}")
+    end = colon + 1 + int(data[pos:colon])
+    if end > len(data):
+        raise BencodeError(f"truncated string at pos {colon + 1}")
+    return colon + 1, end
+
+
+def read_string(data, pos):
+    """:return: (bytes, end)"""
+    start, end = string_span(data, pos)
+    return data[start:end], end
+
+
+def checked(value, kind, what):
+    """:return: value, raise BencodeError if it is not an instance of kind"""
+    if not isinstance(value, kind):
+        raise BencodeError(f"invalid {what}: {type(value).__name__}")
+    return value
+
+
+def decode(data, pos=0):
+    """
+    Decode a (small) value, strings are kept as bytes
+    :return: (value, end)
+    """
+    try:
+        return _decode(data, pos)
+    except RecursionError:
+        raise BencodeError(f"too deeply nested value at pos {pos}") from None
+
+
+def _decode(data, pos):
+    c = data[pos : pos + 1]
+    if c == b"i":
+        end = data.find(b"e", pos)
+        if end < 0 or not PATTERN_INT.fullmatch(data[pos + 1 : end]):
+            raise BencodeError(f"invalid integer at pos {pos}")
+        return int(data[pos + 1 : end]), end + 1
+    if c == b"l":
+        items = []
+        pos += 1
+        while data[pos : pos + 1] != b"e":
+            item, pos = _decode(data, pos)
+            items.append(item)
+        return items, pos + 1
+    if c == b"d":
+        items = {}
+        pos += 1
+        while data[pos : pos + 1] != b"e":
+            key, pos = read_string(data, pos)
+            items[key], pos = _decode(data, pos)
+        return items, pos + 1
+    if c.isdigit():
+        return read_string(data, pos)
+    raise BencodeError(f"invalid value at pos {pos}")
+
+
+def dict_spans(data, pos):
+    """
+    :param pos: int, start of a dict
+    :return: ({key: (start, end)}, end), spans of the values, nothing decoded
+    """
+    if data[pos : pos + 1] != b"d":
+        raise BencodeError(f"dict expected at pos {pos}")
+    spans = {}
+    pos += 1
+    while data[pos : pos + 1] != b"e":
+        key, pos = read_string(data, pos)
+        end = skip_value(data, pos)
+        spans[key] = (pos, end)
+        pos = end
+    return spans, pos + 1
+
+
+def info_span(data):
+    """
+    :param data: bytes, content of a torrent file
+    :return: (start, end) of the bencoded "info" dict
+    """
+    spans, _ = dict_spans(data, 0)
+    if b"info" not in spans:
+        raise BencodeError('no "info" in torrent')
+    return spans[b"info"]
+
+
+def info_hash(data):
+    """
+    :param data: bytes, content of a torrent file
+    :return: str, hex of the SHA-1 of the "info" dict
+    """
+    start, end = info_span(data)
+    with memoryview(data) as view:
+        return hashlib.sha1(view[start:end]).hexdigest()
+
+
+class TorrentMetadata:
+    """
+    Lazy view of a torrent file, values of "info" are decoded on demand.
+    "pieces" is skipped, never copied, file entries are decoded one at a time.
+    """
+
+    def __init__(self, data):
+        """
+        :param data: bytes or mmap, content of a torrent file
+        """
+        self.data = data
+        spans, _ = dict_spans(data, 0)
+        if b"info" not in spans:
+            raise BencodeError('no "info" in torrent')
+        self.info_start, self.info_end = spans[b"info"]
+        self.info_keys, _ = dict_spans(data, self.info_start)
+        self.encoding = "utf8"
+        if b"encoding" in spans:
+            encoding = checked(
+                decode(data, spans[b"encoding"][0])[0], bytes, "encoding"
+            )
+            self.encoding = encoding.decode("ascii", errors="replace") or "utf8"
+
+    @classmethod
+    @contextmanager
+    def open(cls, filename):
+        """memory-map the torrent file"""
+        with open(filename, "rb") as f:
+            try:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty file
+                raise BencodeError(f"empty torrent file: {filename}") from None
+        try:
+            yield cls(mm)
+        finally:
+            mm.close()
+
+    def _text(self, value):
+        try:
+            return value.decode(self.encoding, errors="replace")
+        except LookupError:  # unknown encoding
+            return value.decode("utf8", errors="replace")
+
+    def get(self, key, default=None):
+        """decoded value of the "info" dict, strings are kept as bytes"""
+        span = self.info_keys.get(key.encode())
+        if span is None:
+            return default
+        return decode(self.data, span[0])[0]
+
+    @property
+    def info_hash(self):
+        with memoryview(self.data) as view:
+            return hashlib.sha1(view[self.info_start : self.info_end]).hexdigest()
+
+    @property
+    def name(self):
+        name = self.get("name.utf-8") or self.get("name") or b""
+        return self._text(checked(name, bytes, "name"))
+
+    @property
+    def is_multi_file(self):
+        return b"files" in self.info_keys
+
+    @property
+    def length(self):
+        """total length of the files"""
+        if not self.is_multi_file:
+            return checked(self.get("length", 0), int, "length")
+        return sum(file.length for file in self.files())
+
+    def files(self):
+        """
+        yield TorrentFile(index, path, length) of multi-files torrent, index starts with 1
+        """
+        if not self.is_multi_file:
+            return
+        pos = self.info_keys[b"files"][0]
+        if self.data[pos : pos + 1] != b"l":
+            raise BencodeError(f"list of files expected at pos {pos}")
+        pos += 1
+        idx = 0
+        while self.data[pos : pos + 1] != b"e":
+            entry, pos = decode(self.data, pos)
+            if not isinstance(entry, dict):
+                raise BencodeError(f"invalid file entry at pos {pos}")
+            idx += 1
+            path = checked(
+                entry.get(b"path.utf-8") or entry.get(b"path") or [], list, "path"
+            )
+            yield TorrentFile(
+                idx,
+                tuple(self._text(checked(part, bytes, "path")) for part in path),
+                checked(entry.get(b"length", 0), int, "length"),
+            )
+
+
+def magnet_info_hash(uri):
+    """
+    :param uri: str, magnet URI
+    :return: str, hex of BitTorrent info hash, None if not a BitTorrent magnet
+    """
+    for xt in parse_qs(urlsplit(uri).query).get("xt", []):
+        matched = PATTERN_BTIH.fullmatch(xt.strip())
+        if not matched:
+            continue
+        btih = matched.group(1)
+        if len(btih) == 40:
+            return btih.lower()
+        if len(btih) == 32:
+            try:
+                return base64.b32decode(btih.upper()).hex()
+            except binascii.Error:  # not base32
+                return None
+    return None
+
+
+def normalize_uri(uri):
+    """lowercase scheme and host, drop the default port and the fragment"""
+    parts = urlsplit(uri.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if ":" in host:  # IPv6
+        host = f"[{host}]"
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    netloc = host if port in (None, DEFAULT_PORTS.get(scheme)) else f"{host}:{port}"
+    if parts.username is not None:
+        userinfo = parts.username
+        if parts.password is not None:
+            userinfo += f":{parts.password}"
+        netloc = f"{userinfo}@{netloc}"
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, ""))
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Startup time, import time and peak RSS of the entry points.
+
+Run it before and after a change of the imports, e.g.
+    ./benchmark-startup.py -n 10
+    ./benchmark-startup.py --top 10 aria2rpc-cli.py config
+"""
+
+import click
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+from pathlib import Path
+
+
+BASE_DIR = Path(__file__).resolve().parent
+COMMANDS = [
+    ["aria2rpc-cli.py", "--help"],
+    ["aria2rpc-cli.py", "config"],
+    ["aria2rpc-cli.py", "add", "--help"],
+    ["aria2rpc-oversee.py", "--help"],
+    ["on-download-complete.py", "--help"],
+    ["show-torrent-info.py", "--help"],
+]
+# import time:     self [us] | cumulative | imported package
+PATTERN_IMPORT_TIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def run(command, importtime=False):
+    """
+    :return: (wall time in seconds, max RSS in KiB, stderr)
+    """
+    args = [sys.executable, *(["-X", "importtime"] if importtime else []), *command]
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        args,
+        cwd=BASE_DIR,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    stderr = proc.stderr.read()
+    _, status, rusage = os.wait4(proc.pid, 0)
+    wall = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    proc.stderr.close()
+    return wall, rusage.ru_maxrss, stderr
+
+
+def parse_importtime(stderr):
+    """
+    :return: (total import time in seconds, [(cumulative seconds, module)] of top-level imports)
+    """
+    top_level = []
+    for line in stderr.splitlines():
+        matched = PATTERN_IMPORT_TIME.match(line)
+        if matched and len(matched.group(3)) == 1:  # not imported by another module
+            top_level.append((int(matched.group(2)) / 1e6, matched.group(4)))
+    return sum(t for t, _ in top_level), sorted(top_level, reverse=True)
+
+
+@click.command()
+@click.option("-n", "--repeat", default=5, help="Runs per command.", show_default=True)
+@click.option(
+    "--top",
+    default=5,
+    help="Top-level imports to show per command, by cumulative time.",
+    show_default=True,
+)
+@click.argument("command", nargs=-1)
+def main(repeat, top, command):
+    """Benchmark the startup of COMMAND, default: all the entry points"""
+    commands = [list(command)] if command else COMMANDS
+    click.echo(f"{'command':<36} {'wall':>9} {'imports':>9} {'max RSS':>9}")
+    for args in commands:
+        runs = [run(args) for _ in range(repeat)]
+        wall = statistics.median(r[0] for r in runs)
+        rss = statistics.median(r[1] for r in runs)
+        import_time, imports = parse_importtime(run(args, importtime=True)[2])
+        click.echo(
+            f"{' '.join(args):<36} {wall * 1000:7.1f}ms {import_time * 1000:7.1f}ms"
+            f" {rss / 1024:7.1f}MB"
+        )
+        for seconds, module in imports[:top]:
+            click.echo(f"    {seconds * 1000:7.1f}ms  {module}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,18 @@
 #!/usr/bin/env python3
 # ~/callbacks.py
-import shutil
-
-import aria2p
 import click
+import importlib.util
 import logging
+import os
+import signal
+import socket
+import stat
 import subprocess
+import time
 
+from functools import partial
 from pathlib import Path
+from threading import Event
 
 from aria2rpc import (
     load_aria2_config,
@@ -15,10 +20,21 @@ from aria2rpc import (
     DEFAULT_ARIA2_CONFIG,
     DEFAULT_ARIA2_HOST,
     DEFAULT_ARIA2_PORT,
+    DEFAULT_HOOK_SOCKET,
+    DEFAULT_MOVE_QUEUE,
 )
+from aria2rpc.hook import forward, HookDaemon, DEFAULT_QUEUE_SIZE, DEFAULT_WORKERS
+from aria2rpc.lazy import lazy_import
+from aria2rpc.mover import DEFAULT_WORKERS as DEFAULT_MOVE_WORKERS, CHECKSUMS, Mover
+from aria2rpc.scheduler import DEFAULT_DEVICE_LIMIT, MoveScheduler
+
+
+# imported once the hook needs to call aria2, spawned for every completed task
+aria2p = lazy_import("aria2p")
 
 
-LOG_FORMAT = "%(asctime)-15s [%(levelname)s] %(message)s"
+LOG_FORMAT = "%(asctime)-15s [%(levelname)s] %(threadName)s %(message)s"
+WATCHER_RETRY_INTERVAL = 5
 logger = logging.getLogger()
 
 
@@ -45,7 +61,9 @@ def print_task_info(task):
     )
 
 
-def on_download_complete(api, gid):
+def on_download_complete(
+    api, gid, move_workers=DEFAULT_MOVE_WORKERS, scheduler=None, checksum=None
+):
     task: aria2p.downloads.Download
     task = api.get_download(gid)
     print_task_info(task)
@@ -56,66 +74,145 @@ def on_download_complete(api, gid):
         return
     # move files from tmp dir to another
     if ".tmp" == task.dir.name:
-        subprocess.call(["chmod", "-R", "g+w", Path(task.dir)])
         destination = Path(task.dir.parent)
         logger.info(
             f'[{gid}] Task Completed: move "{task.name}" from {task.dir} to {destination}'
         )
-        if move_or_merge(task, destination):
-            control_file = task.control_file_path
-            if control_file.exists():
-                logger.info(f"[{gid}] Remove control file: {control_file}")
-                control_file.unlink()
-            # do not purge bt task
-            # task.purge()
+        job = {
+            "gid": gid,
+            "paths": [str(path) for path in task.root_files_paths],
+            "destination": str(destination),
+            "control_file": str(task.control_file_path),
+            "size": task.total_length,
+        }
+        if scheduler:
+            scheduler.submit(job)
+        else:
+            run_move(job, move_workers, checksum=checksum)
+        # do not purge bt task
+        # task.purge()
+
+
+def run_move(job, workers=DEFAULT_MOVE_WORKERS, throttle=None, checksum=None):
+    """
+    :param job: dict, see `on_download_complete`, saved by the scheduler for a restart
+    :return: bool
+    """
+    gid = job["gid"]
+    paths = [Path(path) for path in job["paths"]]
+    destination = Path(job["destination"])
+    if not move_or_merge(gid, paths, destination, workers, throttle, checksum):
+        return False
+    control_file = Path(job["control_file"])
+    if control_file.exists():
+        logger.info(f"[{gid}] Remove control file: {control_file}")
+        control_file.unlink()
+    return True
 
 
-def move_or_merge(task: aria2p.downloads.Download, destination: Path) -> bool:
+def move_or_merge(
+    task_id: str,
+    paths: list,
+    destination: Path,
+    workers: int = DEFAULT_MOVE_WORKERS,
+    throttle=None,
+    checksum=None,
+) -> bool:
+    moved = {"files": 0, "bytes": 0, "dirs": 0}
+
+    def progress(src, dst, size):
+        if size is None:
+            moved["dirs"] += 1
+            logger.debug(f"[{task_id}] --> rename {src} {dst}")
+        else:
+            moved["files"] += 1
+            moved["bytes"] += size
+            logger.debug(f"[{task_id}] --> {src} {dst} ({size} bytes)")
+
+    # 同设备直接 rename，跨设备并行复制后删除源文件；目标已存在时合并目录
+    mover = Mover(
+        workers=workers,
+        mode_add=stat.S_IWGRP,
+        progress=progress,
+        throttle=throttle,
+        checksum=checksum,
+    )
+    start = time.monotonic()
+    logger.info(f"[{task_id}] Move {paths=} to {destination}")
     all_success = True
-    task_id = task.gid
-    if destination.exists():  # 目标已存在，使用 rsync
-        logger.info(f"[{task_id}] Sync {task.root_files_paths=} to {destination}")
-        for path in task.root_files_paths:
-            # rsync 同步，然后删除源文件（移动，但保留空目录）
-            result = subprocess.run(
-                ["/usr/bin/rsync", "-ahvP", "--remove-source-files", path, destination],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-            )
-            exit_code = result.returncode
-            stdout_output = result.stdout
-            stderr_output = result.stderr
+    for path in paths:
+        if not os.path.lexists(path):  # moved before a restart
+            logger.info(f"[{task_id}] --> {path} is gone, skip")
+            continue
+        if not mover.merge(path, destination / path.name):
+            logger.info(f"[{task_id}] --> move {path} failed, kept the rest in place")
+            all_success = False
+    logger.info(
+        f"[{task_id}] Moved {moved['files']} files, {moved['bytes']} bytes,"
+        f" renamed {moved['dirs']} directories in {time.monotonic() - start:.1f}s"
+    )
+    return all_success
 
-            logger.debug(
-                f"[{task_id}] --> rsync -ahvP --remove-source-files {path} {destination}"
-            )
-            for line in stdout_output.splitlines():
-                logger.debug(f"[{task_id}] {line}")
-            for line in stderr_output.splitlines():
-                logger.debug(f"[{task_id}] {line}")
-            logger.debug(f"[{task_id}] {exit_code=}")
-
-            if exit_code == 0:
-                if path.is_dir():  # 删除目录树
-                    logger.info(f"[{task_id}] --> rm -rf {path}")
-                    shutil.rmtree(path, ignore_errors=True)
-                else:  # 删除文件
-                    logger.info(f"[{task_id}] --> rm {path}")
-                    path.unlink(missing_ok=True)
-            else:
-                logger.info(f"[{task_id}] --> rsync failed. exit code: {exit_code}")
-                all_success = False
-        return all_success
-    else:
-        logger.info(f"[{task_id}] move {task.root_files_paths=} to {destination}")
-        return task.move_files(destination)
+
+def setup_logging():
+    logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT)
+
+    fh = logging.FileHandler("/tmp/aria2-event.log")
+    fh.setLevel(logging.DEBUG)
+    fh.setFormatter(logging.Formatter(LOG_FORMAT))
+    logger.addHandler(fh)
+
+
+def serve(api, socket_path, workers, queue_size, notifications, scheduler):
+    """run the hooks of the forwarded gids until a signal"""
+    exit_event = Event()
+
+    def signal_handler(signum, _frame):
+        exit_event.set()
+        logger.info(f"Interrupt by signal {signal.Signals(signum).name}.")
+
+    for sig in ("TERM", "HUP", "INT"):
+        signal.signal(getattr(signal, "SIG" + sig), signal_handler)
+
+    daemon = HookDaemon(
+        partial(on_download_complete, api, scheduler=scheduler),
+        socket_path,
+        workers,
+        queue_size,
+    )
+    try:
+        daemon.start()
+    except OSError as e:
+        raise click.ClickException(f"Cannot listen on {socket_path}: {e.strerror}.")
+    # after the socket, a second service must not resume the moves of the first
+    scheduler.start()
+    watcher = None
+    if notifications:
+        from aria2p.client import NOTIFICATION_COMPLETE
+        from aria2rpc.events import Aria2EventWatcher
+
+        def on_notification(notification_type, gid):
+            if notification_type == NOTIFICATION_COMPLETE:
+                logger.info(f"[{gid}] Notified: {notification_type}")
+                daemon.submit(gid)
+
+        watcher = Aria2EventWatcher(api.client, on_notification=on_notification)
+    while not exit_event.is_set():
+        if watcher and not watcher.is_alive():  # reconnect
+            watcher.start()
+        exit_event.wait(WATCHER_RETRY_INTERVAL)
+    if watcher:
+        watcher.stop()
+    logger.info(f"Wait for {daemon.queue.qsize()} queued hooks.")
+    daemon.stop()
+    logger.info("Wait for the running moves, the queued ones are resumed on restart.")
+    scheduler.stop()
 
 
 @click.command()
-@click.argument("gid")
-@click.argument("file-count")
-@click.argument("destination")
+@click.argument("gid", required=False)
+@click.argument("file-count", required=False)
+@click.argument("destination", required=False)
 @click.option(
     "--config-file",
     default=DEFAULT_ARIA2_CONFIG,
@@ -131,29 +228,137 @@ def move_or_merge(task: aria2p.downloads.Download, destination: Path) -> bool:
     "--port", help="Aria2 JSON-RPC server port. default: {}".format(DEFAULT_ARIA2_PORT)
 )
 @click.option("--token", help="RPC SECRET string")
-def cli(gid, file_count, destination, config_file, host, port, token):
-    logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT)
+@click.option(
+    "--daemon",
+    is_flag=True,
+    help="Run as a resident service handling the gids forwarded by the hook, "
+    "the hook called by aria2 only forwards its gid to the service if it is running.",
+)
+@click.option(
+    "--socket",
+    "socket_path",
+    default=DEFAULT_HOOK_SOCKET,
+    type=click.Path(),
+    help="Unix socket of the service.",
+    show_default=True,
+)
+@click.option(
+    "--workers",
+    default=DEFAULT_WORKERS,
+    help="Hooks running at the same time in the service.",
+    show_default=True,
+)
+@click.option(
+    "--queue-size",
+    default=DEFAULT_QUEUE_SIZE,
+    help="Gids waiting for a worker of the service, the hook waits when it is full.",
+    show_default=True,
+)
+@click.option(
+    "--move-workers",
+    default=DEFAULT_MOVE_WORKERS,
+    help="Files copied at the same time when a task is moved across devices.",
+    show_default=True,
+)
+@click.option(
+    "--device-limit",
+    default=DEFAULT_DEVICE_LIMIT,
+    help="Moves copying from/to a device at the same time in the service, "
+    "the smallest task first. Renames on a device are not limited.",
+    show_default=True,
+)
+@click.option(
+    "--bandwidth",
+    default=0,
+    help="Copy bandwidth per device in the service, bytes/s. 0: unlimited.",
+    show_default=True,
+)
+@click.option(
+    "--move-queue",
+    default=DEFAULT_MOVE_QUEUE,
+    type=click.Path(dir_okay=False),
+    help="File of the queued moves of the service, resumed on restart.",
+    show_default=True,
+)
+@click.option(
+    "--checksum",
+    type=click.Choice(CHECKSUMS),
+    help="Compare the files already at the destination by content too, "
+    "not only by size and mtime. The source is hashed as it is copied, the copy is "
+    "read back once to verify it before it replaces the destination. xxh64 needs xxhash.",
+)
+@click.option(
+    "--notifications",
+    is_flag=True,
+    help="The service also takes the completed tasks from the aria2 WebSocket notifications.",
+)
+def cli(
+    gid,
+    file_count,
+    destination,
+    config_file,
+    host,
+    port,
+    token,
+    daemon,
+    socket_path,
+    workers,
+    queue_size,
+    move_workers,
+    device_limit,
+    bandwidth,
+    move_queue,
+    checksum,
+    notifications,
+):
+    if not daemon:
+        if gid is None:
+            raise click.UsageError("Missing argument 'GID'.")
+        try:
+            reply = forward(
+                socket_path, gid, file_count=file_count, destination=destination
+            )
+        except socket.timeout:
+            click.echo(f"[{gid}] The service is busy, it runs the hook later.")
+            return
+        if reply is not None:
+            click.echo(f"[{gid}] Forwarded to {socket_path}: {reply}")
+            return
 
-    fh = logging.FileHandler("/tmp/aria2-event.log")
-    fh.setLevel(logging.DEBUG)
-    fh.setFormatter(logging.Formatter(LOG_FORMAT))
-    logger.addHandler(fh)
+    if checksum == "xxh64" and importlib.util.find_spec("xxhash") is None:
+        raise click.UsageError(
+            "--checksum xxh64 needs xxhash, try `pip install xxhash`."
+        )
 
-    logger.info(f'[{gid}] Arguments: {gid=} {file_count=} destination="{destination}"')
+    setup_logging()
+    if not daemon:
+        logger.info(
+            f'[{gid}] Arguments: {gid=} {file_count=} destination="{destination}"'
+        )
 
     config = load_aria2_config(config_file)
     logger.debug(config)
 
-    on_download_complete(
-        aria2p.API(
-            aria2p.Client(
-                host=host or config.get("host"),
-                port=port or config.get("port"),
-                secret=token or config.get("token"),
-            )
-        ),
-        gid,
-    )
+    from aria2rpc.client import create_client
+
+    client = create_client(config, host, port, token, pool_size=workers)
+    if daemon:
+        scheduler = MoveScheduler(
+            partial(run_move, workers=move_workers, checksum=checksum),
+            device_limit=device_limit,
+            bandwidth=bandwidth,
+            queue_file=move_queue,
+        )
+        serve(
+            aria2p.API(client),
+            socket_path,
+            workers,
+            queue_size,
+            notifications,
+            scheduler,
+        )
+    else:
+        on_download_complete(aria2p.API(client), gid, move_workers, checksum=checksum)
 
 
 if __name__ == "__main__":
@@ -3,10 +3,16 @@
 import click
 import json
 import math
-import torrent_parser as tp
 
 from pathlib import Path
 
+from aria2rpc.lazy import lazy_import
+from aria2rpc.torrent import TorrentMetadata
+
+
+# only the JSON dump needs the full parser
+tp = lazy_import("torrent_parser")
+
 
 units = ["B", "KiB", "MiB", "GiB", "TiB", "PiB", "EiB", "ZiB", "YiB"]
 
@@ -23,17 +29,15 @@ def sizeof_fmt(num):
 @click.argument("url-or-torrent-path", nargs=-1, required=True)
 def main(file_list, url_or_torrent_path):
     for uri in url_or_torrent_path:
-        torrent = tp.parse_torrent_file(uri)
         if file_list:
-            if "files" in torrent["info"]:
-                for file_info in torrent["info"]["files"]:
-                    file_path = Path(*file_info["path"])
-                    file_length = file_info["length"]
+            with TorrentMetadata.open(uri) as torrent:
+                for _, file_path_info, file_length in torrent.files():
+                    file_path = Path(*file_path_info)
                     click.echo(
                         f"{Path(uri).name}\t{sizeof_fmt(file_length):>8}\t{file_path}"
                     )
-            pass
         else:
+            torrent = tp.parse_torrent_file(uri)
             print(json.dumps(torrent, sort_keys=True, indent=4))
 
 